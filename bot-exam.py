@@ -1,16 +1,29 @@
+import time
+STARTUP_STARTED = time.perf_counter()  # Отсчёт времени старта, включая импорты
+
 import telebot
 from telebot.types import Message, BotCommand
 from telebot.types import ReplyKeyboardMarkup, KeyboardButton
 from telebot import types
+from telebot.handler_backends import BaseMiddleware, CancelUpdate
 from config import TOKEN_TG, TOKEN_AI
-from groq import Groq
+try:
+    from config import ADMIN_IDS
+except ImportError:
+    ADMIN_IDS = []
+from storage import (ExamSession, UserStats, TopicMastery, PHASE_ANSWER, PHASE_ACTION,
+                     get_question_hash, load_sessions, load_stats, save_sessions, save_stats,
+                     write_atomic)
+from prompts import BATCH_ITEM, format_usage, get_template, record_usage
 import os
 import json
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import random
 import re
-import time
-import requests
+import threading
 
 # Настройка логирования
 logging.basicConfig(level=logging.ERROR)
@@ -19,17 +32,54 @@ for logger_name in ("httpx", "telebot"):
 
 logger = logging.getLogger(__name__)
 
+class LazyGroqClient:
+    """
+    Клиент Groq, создаваемый при первом обращении: импорт groq — самая долгая
+    часть старта, а до первого запроса к ИИ он не нужен
+    """
+
+    def __init__(self, api_key):
+        self._api_key = api_key
+        self._client = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from groq import Groq
+                    self._client = Groq(api_key=self._api_key)
+        return getattr(self._client, name)
+
 # Инициализация
-bot = telebot.TeleBot(TOKEN_TG)
-client = Groq(api_key=TOKEN_AI)
+bot = telebot.TeleBot(TOKEN_TG, use_class_middlewares=True)
+client = LazyGroqClient(TOKEN_AI)
 DEFAULT_MODEL = 'openai/gpt-oss-120b'
+SMALL_MODEL = 'meta-llama/llama-4-maverick-17b-128e-instruct'
 
 # Константы
-USER_STATS_FILE = "user_stats.json"
+USER_STATS_FILE = "user_stats.bin"
 USER_MESSAGES_FILE = "user_messages.json"
-EXAM_STATE_FILE = "exam_states.json"
+EXAM_STATE_FILE = "exam_states.bin"
+LEGACY_USER_STATS_FILE = "user_stats.json"  # Старый JSON-формат, читается при миграции
+LEGACY_EXAM_STATE_FILE = "exam_states.json"
 USER_QUESTION_STATS_FILE = "user_question_stats.json"
+COMMANDS_HASH_FILE = "bot_commands.hash"  # Хеш последнего установленного списка команд
+TOPICS_FILE = "theory/topics.json"  # Необязательный: добавляет/переопределяет темы без рестарта
 MAX_CONTEXT_LENGTH = 3000
+BANK_RELOAD_INTERVAL = 5  # Секунды между проверками файлов банков вопросов
+TICKET_SIZE = 3  # Вопросов в билете
+GRADING_MAX_TOKENS = 1024  # Потолок выходных токенов (с рассуждениями) на оценку одного ответа
+GRADING_BATCH_TOKENS_PER_ITEM = 512  # То же на каждый вопрос билета
+GRADING_REPAIR_MAX_TOKENS = 400  # Потолок для прохода починки JSON малой моделью
+GRADING_REASONING_EFFORT = "low"
+GRADE_MAX_POINTS = 3  # Пунктов в missing/strengths
+THEORY_CACHE_LIMIT = 500  # Сколько сгенерированных объяснений теории держать в памяти
+PREFETCH_THEORY_TYPES = ("dry",)  # Какую теорию готовить заранее: ("dry", "zoomers") — обе, () — только выбор вопроса
+PREFETCH_WORKERS = 2  # Фоновых потоков предвыборки
+PREFETCH_MAX_PENDING = 4  # Бюджет: запросов теории в очереди и в работе одновременно
+PROCESSED_MESSAGES_LIMIT = 10000  # Сколько последних сообщений помнить для отсева повторов
+DIFFICULTY_PRIOR_WEIGHT = 2  # Вес общей сложности вопроса в оценках пользователя (псевдо-ответы)
 
 # Конфигурация тем экзамена
 EXAM_TOPICS = {
@@ -58,6 +108,7 @@ EXAM_TOPICS = {
         "display_name": "Test 🎙️"
     }
 }
+DEFAULT_EXAM_TOPICS = dict(EXAM_TOPICS)
 
 
 # Глобальные переменные
@@ -66,8 +117,17 @@ user_stats = {}
 answers_data = {}
 user_exam_state = {}
 user_question_stats = {}
+user_topic_mastery = {}  # user_id -> {topic_key: TopicMastery}, строится из user_question_stats
+question_difficulty = {}  # topic_key -> {ID вопроса: [сумма средних баллов пользователей, число пользователей]}
+difficulty_lock = threading.RLock()  # Сборка, обновление и запись индексов сложности
 
 topic_cache = {}
+topic_index = {}  # topic_key -> {ID вопроса: текст вопроса}
+retired_questions = {}  # ID -> (вопрос, ответ) для вопросов, удалённых горячей перезагрузкой
+bank_mtimes = {}  # Файл банка -> mtime, с которым он был загружен
+bank_reload_lock = threading.Lock()
+save_data_lock = threading.Lock()
+startup_timings = {}  # Этап старта -> секунды
 
 # ======================== УТИЛИТЫ ========================
 
@@ -100,14 +160,47 @@ def load_data(filename):
         return {}
 
 
-def save_data(filename, data):
-    """Сохранение данных в JSON файл"""
-    with open(filename, "w", encoding='utf-8') as file:
-        json.dump(data, file, ensure_ascii=False, indent=4)
+def save_data(filename, data, compact=False):
+    """
+    Сохранение данных в JSON файл; при падении на диске остаётся прошлая версия.
+    compact — без отступов, для служебных файлов, которые перезаписываются часто
+    """
+    with save_data_lock:
+        if compact:
+            payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+        else:
+            payload = json.dumps(data, ensure_ascii=False, indent=4)
+        write_atomic(filename, payload.encode('utf-8'))
 
 def save_exam_state():
     """Сохранение состояний экзамена"""
-    save_data(EXAM_STATE_FILE, user_exam_state)
+    save_sessions(EXAM_STATE_FILE, user_exam_state)
+
+def save_user_stats():
+    """Сохранение статистики пользователей"""
+    save_stats(USER_STATS_FILE, user_stats)
+
+def load_records(loader, filename, legacy_filename):
+    """
+    Загрузка бинарных записей (или старого JSON) с проверками.
+    Нечитаемый бинарный файл откладывается в сторону, а не перезаписывается
+    первым же сохранением: дальше читается старый JSON, если он есть
+    """
+    try:
+        return loader(filename, legacy_filename)
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке {filename}: {e}")
+        if not os.path.exists(filename):
+            return {}
+
+    corrupt_filename = f"{filename}.corrupt-{time.strftime('%Y%m%d-%H%M%S')}"
+    os.replace(filename, corrupt_filename)  # Если не вышло — падаем, но не затираем единственную копию
+    logger.error(f"{filename} перенесён в {corrupt_filename}")
+    try:
+        return loader(filename, legacy_filename)
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке {legacy_filename}: {e}")
+        return {}
 
 def load_topic_data(topic_key):
     """Загрузка данных для темы с кэшированием"""
@@ -116,19 +209,35 @@ def load_topic_data(topic_key):
     
     if topic_key in EXAM_TOPICS:
         questions_file = EXAM_TOPICS[topic_key]["questions_file"]
+        bank_mtimes[questions_file] = get_file_mtime(questions_file)
         data = load_data(questions_file)
+        topic_index[topic_key] = build_topic_index(data)
+        load_question_difficulty(topic_key)
         topic_cache[topic_key] = data  # Кэшируем
         return data
     return {}
 
+def build_topic_index(data):
+    """Индекс ID вопроса -> текст вопроса"""
+    return {get_question_hash(question): question for question in data}
+
+def get_question_by_id(topic_key, question_id):
+    """Текст вопроса и эталон по ID; (None, None), если вопроса больше нет"""
+    data = load_topic_data(topic_key)
+    question = topic_index.get(topic_key, {}).get(question_id)
+    if question is not None and question in data:
+        return question, data[question]
+    return retired_questions.get(question_id, (None, None))
+
 def get_user_questions(user_id):
     """Получить вопросы пользователя из состояния"""
     user_id_str = str(user_id)
-    if user_id_str in user_exam_state:
+    session = user_exam_state.get(user_id_str)
+    if session is not None and session.question_id:
         # Возвращаем только текущий вопрос и ответ
-        question = user_exam_state[user_id_str].get("question", "")
-        answer = user_exam_state[user_id_str].get("correct_answer", "")
-        return {question: answer}
+        question, answer = get_question_by_id(session.topic, session.question_id)
+        if question is not None:
+            return {question: answer}
     return {}
 
 
@@ -155,28 +264,51 @@ def send_message_safe(chat_id, text, markup=None):
     except Exception:
         bot.send_message(chat_id, text, reply_markup=markup)
 
-def parse_ai_score(ai_response):
+def extract_json_object(text):
+    """Достаёт JSON-объект из ответа модели (учитывает ```json и текст вокруг)"""
+    text = remove_think_blocks(text or "")
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end <= start:
+        return None
+    try:
+        data = json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
+
+def validate_grade(data):
     """
-    Извлекает процент оценки из ответа ИИ
-    Ищет паттерн: "Оценка: XX%"
-    Возвращает число 0-100 или None при ошибке
+    Проверяет оценку по схеме {"score": 0-100, "missing": [str], "strengths": [str]}
+    Возвращает нормализованный dict или None
     """
-    # Основной паттерн: "Оценка: XX%"
-    match = re.search(r"Оценка:\s*(\d{1,3})%", ai_response, re.IGNORECASE)
-    if match:
-        score = int(match.group(1))
-        # Проверяем валидность (0-100%)
-        if 0 <= score <= 100:
-            return score
-    
-    # Запасной паттерн: просто "XX%" в начале строки
-    match = re.search(r"^(\d{1,3})%", ai_response.strip())
-    if match:
-        score = int(match.group(1))
-        if 0 <= score <= 100:
-            return score
-            
-    return None
+    if not isinstance(data, dict):
+        return None
+    score = data.get("score")
+    if isinstance(score, str) and score.strip().rstrip("%").isdigit():
+        score = int(score.strip().rstrip("%"))
+    if isinstance(score, bool) or not isinstance(score, (int, float)) or not 0 <= score <= 100:
+        return None
+    
+    grade = {"score": round(score)}
+    for field in ("missing", "strengths"):
+        value = data.get(field, [])
+        if isinstance(value, str):
+            value = [value]
+        if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+            return None
+        grade[field] = [item.strip() for item in value if item.strip()][:GRADE_MAX_POINTS]
+    return grade
+
+def format_grade(grade):
+    """Текст оценки для пользователя"""
+    lines = [f"Оценка: {grade['score']}%"]
+    if grade["strengths"]:
+        lines.append("\n👍 Хорошо:")
+        lines.extend(f"• {point}" for point in grade["strengths"])
+    if grade["missing"]:
+        lines.append("\n📌 Не хватает:")
+        lines.extend(f"• {point}" for point in grade["missing"])
+    return "\n".join(lines)
 
 def correct_transcription(text: str) -> str:
     """Исправляет ошибки транскрибации с помощью ИИ"""
@@ -185,24 +317,9 @@ def correct_transcription(text: str) -> str:
     if len(text.strip()) < 5:
         return text
     
-    prompt = f"""
-        Ты — эксперт по исправлению ошибок распознавания речи.
-        ЗАДАЧА: Исправь ошибки в тексте, сохраняя смысл и стиль автора.
-
-        ПРАВИЛА:
-        1. Если сомневаешься — оставляй как есть
-        2. Отвечай ТОЛЬКО исправленным текстом без комментариев
-
-        ИСХОДНЫЙ ТЕКСТ: {text}
-
-        ИСПРАВЛЕННЫЙ ТЕКСТ:"""
-
     try:
-        response = client.chat.completions.create(
-            messages=[{"role": "user", "content": prompt}],
-            model='meta-llama/llama-4-maverick-17b-128e-instruct',
-            temperature=0.1,
-        )
+        response = request_completion(get_template("correct_transcription"), {"text": text},
+                                      SMALL_MODEL, temperature=0.1)
         
         corrected_text = response.choices[0].message.content.strip()
         return corrected_text
@@ -212,13 +329,80 @@ def correct_transcription(text: str) -> str:
         return text  # Возвращаем исходный текст при ошибке
 
 
+# ======================== ПОВТОРЫ И СКЛЕЙКА ЗАПРОСОВ ========================
+
+# Счётчики сэкономленных запросов
+coalesce_metrics = {
+    "duplicates": 0,        # Повторно доставленных сообщений отброшено
+    "coalesced_chat": 0,    # Сообщений чата, склеенных со следующим запросом
+    "rejected_answers": 0,  # Ответов, пришедших во время проверки предыдущего
+}
+coalesce_lock = threading.Lock()
+answers_in_grading = set()  # user_id, чей ответ сейчас оценивается
+chat_pending = {}  # user_id -> сообщения, пришедшие во время запроса к ИИ
+
+class DeduplicationMiddleware(BaseMiddleware):
+    """
+    Отбрасывает уже обработанные сообщения: после переподключения поллинга
+    Telegram может доставить те же апдейты повторно
+    """
+
+    def __init__(self, limit=PROCESSED_MESSAGES_LIMIT):
+        super().__init__()
+        self.update_types = ['message']
+        self.limit = limit
+        self.processed = OrderedDict()  # (chat_id, message_id) в порядке поступления
+
+    def pre_process(self, message, data):
+        key = (message.chat.id, message.message_id)
+        with coalesce_lock:
+            if key in self.processed:
+                coalesce_metrics["duplicates"] += 1
+                return CancelUpdate()
+            self.processed[key] = True
+            if len(self.processed) > self.limit:
+                self.processed.popitem(last=False)
+
+    def post_process(self, message, data, exception):
+        pass
+
+bot.setup_middleware(DeduplicationMiddleware())
+
+def try_begin_grading(user_id_str):
+    """Отмечает, что ответ пользователя проверяется; False — проверка уже идёт"""
+    with coalesce_lock:
+        if user_id_str in answers_in_grading:
+            coalesce_metrics["rejected_answers"] += 1
+            return False
+        answers_in_grading.add(user_id_str)
+        return True
+
+def end_grading(user_id_str):
+    with coalesce_lock:
+        answers_in_grading.discard(user_id_str)
+
+def is_grading(user_id_str):
+    with coalesce_lock:
+        return user_id_str in answers_in_grading
+
+def format_coalesce_metrics():
+    with coalesce_lock:
+        metrics = dict(coalesce_metrics)
+    return (
+        f"♻️ Сэкономлено запросов:\n\n"
+        f"Отброшено повторных апдейтов: {metrics['duplicates']}\n"
+        f"Склеено сообщений чата: {metrics['coalesced_chat']}\n"
+        f"Отклонено ответов во время проверки: {metrics['rejected_answers']}"
+    )
+
 # ======================== КЛАВИАТУРЫ ========================
 
 def get_main_keyboard():
     """Основная клавиатура"""
     keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
-    keyboard.row(KeyboardButton("📚 Начать экзамен"))
-    keyboard.row(KeyboardButton("📊 Статистика"), KeyboardButton("🗑 Очистить историю"))
+    keyboard.row(KeyboardButton("📚 Начать экзамен"), KeyboardButton("🎫 Билет"))
+    keyboard.row(KeyboardButton("📈 Прогресс"), KeyboardButton("📊 Статистика"))
+    keyboard.row(KeyboardButton("🗑 Очистить историю"))
     return keyboard
 
 def get_exam_keyboard():
@@ -229,6 +413,13 @@ def get_exam_keyboard():
     keyboard.row(KeyboardButton("⏭️ Следующий вопрос"), KeyboardButton("❌ Завершить экзамен"))
     return keyboard
 
+def get_ticket_keyboard():
+    """Клавиатура после проверки билета"""
+    keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
+    keyboard.row(KeyboardButton("🎫 Следующий билет"))
+    keyboard.row(KeyboardButton("❌ Завершить экзамен"))
+    return keyboard
+
 def get_hidden_keyboard():
     """Скрытая клавиатура"""
     return types.ReplyKeyboardRemove()
@@ -239,38 +430,38 @@ def initialize_user(user_id, user_data):
     """Инициализация пользователя"""
     user_id_str = str(user_id)
     if user_id_str not in user_stats:
-        user_stats[user_id_str] = {
-            "username": user_data.get('username', 'Unknown'),
-            "text_requests": 0,
-            "voice_requests": 0,
-            "model": DEFAULT_MODEL,
-            "exam_answered": 0
-        }
-        save_data(USER_STATS_FILE, user_stats)
+        user_stats[user_id_str] = UserStats(username=user_data.get('username', 'Unknown'))
+        save_user_stats()
     
     if user_id_str not in user_messages:
         user_messages[user_id_str] = []
 
 def load_all_data():
-    """Загрузка всех данных при старте"""
+    """Загрузка всех данных при старте: файлы состояния читаются параллельно"""
     global user_messages, user_stats, answers_data, user_exam_state, user_question_stats
-    user_messages = load_data(USER_MESSAGES_FILE)
-    user_stats = load_data(USER_STATS_FILE)
-    user_exam_state = load_data(EXAM_STATE_FILE)
-    user_question_stats = load_data(USER_QUESTION_STATS_FILE)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        messages = executor.submit(timed, USER_MESSAGES_FILE, load_data, USER_MESSAGES_FILE)
+        stats = executor.submit(timed, USER_STATS_FILE, load_records,
+                                load_stats, USER_STATS_FILE, LEGACY_USER_STATS_FILE)
+        sessions = executor.submit(timed, EXAM_STATE_FILE, load_records,
+                                   load_sessions, EXAM_STATE_FILE, LEGACY_EXAM_STATE_FILE)
+        question_stats = executor.submit(timed, USER_QUESTION_STATS_FILE, load_data,
+                                         USER_QUESTION_STATS_FILE)
+        user_messages = messages.result()
+        user_stats = stats.result()
+        user_exam_state = sessions.result()
+        user_question_stats = question_stats.result()
+    timed("агрегаты освоения", rebuild_topic_mastery)
 
 # ======================== ЭКЗАМЕН ========================
 
-import hashlib
-
-def get_question_hash(question_text):
-    """Создает уникальный хеш для вопроса"""
-    return hashlib.md5(question_text.encode('utf-8')).hexdigest()[:12]
-
 def add_score_to_question(user_id, topic_key, question_text, score, max_history=5):
     """Добавляет оценку к вопросу пользователя"""
     user_id_str = str(user_id)
     question_hash = get_question_hash(question_text)
+    if topic_key in EXAM_TOPICS:
+        # Индекс собирается из user_question_stats — до добавления оценки, иначе она учтётся дважды
+        load_question_difficulty(topic_key)
     
     # Инициализируем структуру если нужно
     if user_id_str not in user_question_stats:
@@ -280,6 +471,7 @@ def add_score_to_question(user_id, topic_key, question_text, score, max_history=
     
     # Получаем текущий список оценок
     scores_list = user_question_stats[user_id_str][topic_key].get(question_hash, [])
+    old_avg = sum(scores_list) / len(scores_list) if scores_list else None
     
     # Добавляем новую оценку
     scores_list.append(score)
@@ -292,6 +484,105 @@ def add_score_to_question(user_id, topic_key, question_text, score, max_history=
     user_question_stats[user_id_str][topic_key][question_hash] = scores_list
     save_data(USER_QUESTION_STATS_FILE, user_question_stats)
 
+    # Обновляем агрегат освоения темы
+    mastery = user_topic_mastery.setdefault(user_id_str, {}).setdefault(topic_key, TopicMastery())
+    mastery.update(question_hash, old_avg, sum(scores_list) / len(scores_list),
+                   user_question_stats[user_id_str][topic_key])
+    update_question_difficulty(topic_key, question_hash, old_avg, sum(scores_list) / len(scores_list))
+
+def get_difficulty_file(topic_key):
+    """Файл индекса сложности лежит рядом с банком темы"""
+    questions_file = EXAM_TOPICS[topic_key]["questions_file"]
+    return os.path.splitext(questions_file)[0] + ".difficulty.json"
+
+def load_question_difficulty(topic_key):
+    """Загрузка индекса сложности темы; если файла нет — однократная сборка по всем пользователям"""
+    if topic_key in question_difficulty:
+        return
+    with difficulty_lock:
+        if topic_key in question_difficulty:
+            return
+        difficulty_file = get_difficulty_file(topic_key)
+        if os.path.exists(difficulty_file):
+            question_difficulty[topic_key] = load_data(difficulty_file)
+            return
+
+        difficulty = {}
+        for topics in list(user_question_stats.values()):
+            for question_hash, scores in list(topics.get(topic_key, {}).items()):
+                if scores:
+                    entry = difficulty.setdefault(question_hash, [0.0, 0])
+                    entry[0] += sum(scores) / len(scores)
+                    entry[1] += 1
+        save_data(difficulty_file, difficulty, compact=True)
+        question_difficulty[topic_key] = difficulty
+
+def update_question_difficulty(topic_key, question_hash, old_avg, new_avg):
+    """Инкрементальное обновление общей сложности вопроса по изменению среднего одного пользователя"""
+    if topic_key not in EXAM_TOPICS:
+        return
+    with difficulty_lock:
+        load_question_difficulty(topic_key)
+        difficulty = question_difficulty[topic_key]
+        total, users = difficulty.get(question_hash, (0.0, 0))
+        if old_avg is None:
+            total, users = total + new_avg, users + 1
+        else:
+            total += new_avg - old_avg
+        # Новый список целиком, а не правка на месте: читатели без блокировки видят согласованную пару
+        difficulty[question_hash] = [total, users]
+        save_data(get_difficulty_file(topic_key), difficulty, compact=True)
+
+def get_expected_score(user_id, topic_key, question_text):
+    """
+    Ожидаемый балл пользователя по вопросу: средний балл остальных студентов
+    как априорная оценка, к которой подмешивается собственная история
+    """
+    question_hash = get_question_hash(question_text)
+    scores = user_question_stats.get(str(user_id), {}).get(topic_key, {}).get(question_hash, [])
+    own_avg = sum(scores) / len(scores) if scores else 0
+
+    total, users = question_difficulty.get(topic_key, {}).get(question_hash, (0.0, 0))
+    if scores:
+        # Собственная история уже учтена в own_avg — априорная оценка только по другим студентам
+        total, users = total - own_avg, users - 1
+    if users <= 0:
+        return own_avg  # Другие ещё не отвечали — как раньше, только своя история
+    prior = total / users
+    return (own_avg * len(scores) + prior * DIFFICULTY_PRIOR_WEIGHT) / (len(scores) + DIFFICULTY_PRIOR_WEIGHT)
+
+def rebuild_topic_mastery():
+    """Полный пересчёт агрегатов освоения — один раз при старте"""
+    global user_topic_mastery
+    user_topic_mastery = {
+        user_id_str: {
+            topic_key: TopicMastery.from_scores(topic_scores)
+            for topic_key, topic_scores in topics.items()
+        }
+        for user_id_str, topics in user_question_stats.items()
+    }
+
+def format_progress_report(user_id):
+    """Отчёт о прогрессе по темам из агрегатов: O(тем), без обхода истории оценок"""
+    topics = user_topic_mastery.get(str(user_id), {})
+    if not topics:
+        return "📈 Прогресса пока нет — ответьте хотя бы на один вопрос экзамена."
+
+    lines = ["📈 Ваш прогресс по темам:"]
+    for topic_key, mastery in topics.items():
+        if not mastery.seen:
+            continue
+        topic_display = EXAM_TOPICS.get(topic_key, {}).get("display_name", topic_key)
+        total = len(load_topic_data(topic_key))
+        lines.append(f"\n{topic_display}\nПройдено вопросов: {mastery.seen}/{total}\n"
+                     f"Средний балл: {round(mastery.mean)}%")
+        for avg, question_id in mastery.weakest:
+            question = get_question_by_id(topic_key, question_id)[0] or "(вопрос удалён)"
+            if len(question) > 70:
+                question = question[:67] + "..."
+            lines.append(f"  • {round(avg)}% — {question}")
+    return "\n".join(lines)
+
 def get_average_score(user_id, topic_key, question_text):
     """Получает средний балл пользователя по вопросу"""
     user_id_str = str(user_id)
@@ -307,7 +598,7 @@ def get_average_score(user_id, topic_key, question_text):
     return 0  # Новый вопрос
 
 def select_adaptive_question(user_id, topic_key, available_questions):
-    """Выбирает вопрос на основе статистики пользователя"""
+    """Выбирает вопрос на основе статистики пользователя и общей сложности вопросов"""
     user_id_str = str(user_id)
     
     # Собираем веса для всех вопросов
@@ -315,7 +606,7 @@ def select_adaptive_question(user_id, topic_key, available_questions):
     questions = list(available_questions.keys())
     
     for question in questions:
-        avg_score = get_average_score(user_id, topic_key, question)
+        avg_score = get_expected_score(user_id, topic_key, question)
         
         # Формула: чем ниже средний балл, тем выше вес
         # Коэффициент 2.0 усиливает разницу
@@ -350,6 +641,7 @@ def get_topics_keyboard():
 
 def start_exam(user_id, chat_id, topic_key):
     user_id_str = str(user_id)
+    cancel_prefetch(user_id_str)
     
     questions_data = load_topic_data(topic_key)
     if not questions_data:
@@ -364,18 +656,14 @@ def start_exam(user_id, chat_id, topic_key):
         return
     
     question = select_adaptive_question(user_id, topic_key, all_questions)
-    correct_answer = questions_data[question]
-    
-    # Сохраняем только текущий вопрос и ответ!
-    user_exam_state[user_id_str] = {
-        "question": question,
-        "correct_answer": correct_answer,  # ← Только нужный ответ
-        "waiting_answer": True,
-        "topic": topic_key,
-        "topic_display": EXAM_TOPICS[topic_key]["display_name"],
-        "start_time": time.time(),
-        # questions: questions_data  # ← УБИРАЕМ ЭТО!
-    }
+    
+    # Сохраняем только ID текущего вопроса, текст берётся из банка темы
+    user_exam_state[user_id_str] = ExamSession(
+        topic=topic_key,
+        question_id=get_question_hash(question),
+        phase=PHASE_ANSWER,
+        start_time=int(time.time()),
+    )
     save_exam_state()
 
     score = get_average_score(user_id, topic_key, question)
@@ -391,25 +679,148 @@ def start_exam(user_id, chat_id, topic_key):
     )
 
 
+# Счётчики оценивания: доля ошибок разбора и расход выходных токенов
+grading_metrics = {
+    "gradings": 0,          # Запросов оценки (без починки)
+    "requests": 0,          # Запросов к модели (включая починку)
+    "parse_failures": 0,    # Ответов, не прошедших схему с первого раза
+    "repaired": 0,          # Из них починено малой моделью
+    "failed": 0,            # Не удалось получить оценку
+    "item_failures": 0,     # Вопросов билета, не прошедших схему в годном пакетном ответе
+    "output_tokens": 0,
+    "max_output_tokens": 0,
+}
+grading_metrics_lock = threading.Lock()
+
+def record_grading_metrics(output_tokens=0, **counters):
+    with grading_metrics_lock:
+        for name, delta in counters.items():
+            grading_metrics[name] += delta
+        grading_metrics["output_tokens"] += output_tokens
+        grading_metrics["max_output_tokens"] = max(grading_metrics["max_output_tokens"], output_tokens)
+
+def request_completion(template, fields, model, **kwargs):
+    """Запрос по шаблону промпта с учётом токенов шаблона; возвращает ответ провайдера"""
+    completion = client.chat.completions.create(
+        messages=template.messages(**fields),
+        model=model,
+        **kwargs,
+    )
+    record_usage(template, getattr(completion, "usage", None))
+    return completion
+
+def request_json_completion(template, fields, model, max_tokens, **kwargs):
+    """Запрос в JSON-режиме с ограничением длины ответа"""
+    chat_completion = request_completion(
+        template, fields, model,
+        response_format={"type": "json_object"},
+        max_completion_tokens=max_tokens,
+        **kwargs,
+    )
+    usage = getattr(chat_completion, "usage", None)
+    record_grading_metrics(output_tokens=getattr(usage, "completion_tokens", 0) or 0, requests=1)
+    return chat_completion.choices[0].message.content or ""
+
+def repair_json(raw_response, task):
+    """Один дешёвый проход малой моделью: приводит ответ к JSON по схеме задачи"""
+    template = get_template(f"repair_{task}")
+    try:
+        return extract_json_object(request_json_completion(
+            template, {"raw_response": remove_think_blocks(raw_response)[:4000]},
+            SMALL_MODEL, GRADING_REPAIR_MAX_TOKENS, temperature=0))
+    except Exception as e:
+        logger.error(f"Ошибка починки JSON оценки: {e}")
+        return None
+
+def failed_json_generation(error):
+    """
+    Текст ответа, отвергнутого проверкой JSON-режима: Groq не отдаёт битый или
+    обрезанный лимитом JSON как content, а отвечает 400 json_validate_failed
+    с исходным текстом в failed_generation. None — другая ошибка запроса.
+    """
+    body = getattr(error, "body", None)
+    if isinstance(body, dict):
+        body = body.get("error", body)
+    if not isinstance(body, dict):
+        return None
+    if body.get("code") != "json_validate_failed" and body.get("failed_generation") is None:
+        return None
+    return body.get("failed_generation") or ""
+
+def request_grade(template, fields, max_tokens, validate):
+    """Запрос оценки → проверка схемы → при неудаче один проход починки"""
+    from groq import BadRequestError  # Лениво, как и клиент: импорт groq не тормозит старт
+
+    try:
+        raw_response = request_json_completion(
+            template, fields, DEFAULT_MODEL, max_tokens, reasoning_effort=GRADING_REASONING_EFFORT)
+        result = validate(extract_json_object(raw_response))
+    except BadRequestError as e:
+        raw_response = failed_json_generation(e)
+        if raw_response is None:
+            raise
+        record_grading_metrics(requests=1)
+        result = None
+    record_grading_metrics(gradings=1)
+    if result is not None:
+        return result
+    
+    record_grading_metrics(parse_failures=1)
+    result = validate(repair_json(raw_response, template.task))
+    if result is not None:
+        record_grading_metrics(repaired=1)
+    else:
+        record_grading_metrics(failed=1)
+        logger.warning(f"Failed to parse grade from AI response: {raw_response[:100]}...")
+    return result
+
+def format_grading_metrics():
+    """Сводка по оцениванию для админов"""
+    with grading_metrics_lock:
+        metrics = dict(grading_metrics)
+    failure_rate = metrics["parse_failures"] / metrics["gradings"] * 100 if metrics["gradings"] else 0
+    avg_tokens = metrics["output_tokens"] / metrics["requests"] if metrics["requests"] else 0
+    return (
+        f"📐 Оценивание:\n\n"
+        f"Оценок запрошено: {metrics['gradings']} (всего запросов к ИИ: {metrics['requests']})\n"
+        f"Ошибок разбора: {metrics['parse_failures']} ({failure_rate:.1f}%)\n"
+        f"Починено: {metrics['repaired']}, потеряно оценок: {metrics['failed']}\n"
+        f"Вопросов билета оценено отдельно из-за схемы: {metrics['item_failures']}\n"
+        f"Выходные токены: в среднем {avg_tokens:.0f}, максимум {metrics['max_output_tokens']}"
+    )
+
+def grade_answer(question, correct_answer, user_answer, topic_key=None):
+    """Оценка одного ответа: возвращает (текст для пользователя, балл или None)"""
+    fields = {"question": question, "correct_answer": correct_answer, "user_answer": user_answer}
+    grade = request_grade(get_template("grade", topic_key), fields, GRADING_MAX_TOKENS, validate_grade)
+    if grade is None:
+        return "⚠️ Не удалось получить оценку от ИИ, ответ не засчитан в статистику.", None
+    return format_grade(grade), grade["score"]
+
 def process_exam_answer(user_id, chat_id, user_answer):
     """Обработка ответа на экзамен"""
     user_id_str = str(user_id)
-    question = user_exam_state[user_id_str]["question"]
-    topic_key = user_exam_state[user_id_str]["topic"]
+    session = user_exam_state[user_id_str]
+    topic_key = session.topic
     
-    # Получаем правильный ответ
-    user_questions = get_user_questions(user_id)
-    correct_answer = user_questions.get(question, "")
+    # Получаем вопрос и правильный ответ по ID
+    question, correct_answer = get_question_by_id(topic_key, session.question_id)
+    if question is None:
+        # Вопрос удалён из банка (например, после перезагрузки после рестарта)
+        bot.send_message(chat_id, "⚠️ Этот вопрос убрали из банка, ответ не засчитан. Держите следующий.")
+        next_question(user_id, chat_id)
+        return
     
     # Меняем состояние
-    user_exam_state[user_id_str]["waiting_answer"] = False
-    user_exam_state[user_id_str]["waiting_action"] = True
+    session.phase = PHASE_ACTION
     save_exam_state()  # Сохраняем изменения
     
     # Увеличиваем счетчик
-    user_stats[user_id_str]["exam_answered"] = user_stats[user_id_str].get("exam_answered", 0) + 1
-    save_data(USER_STATS_FILE, user_stats)
+    user_stats[user_id_str].exam_answered += 1
+    save_user_stats()
 
+    # Пока идёт оценка, заранее выбираем следующий вопрос и готовим его теорию
+    start_prefetch(user_id, topic_key)
     
     # Оценка ответа
 
@@ -424,48 +835,13 @@ def process_exam_answer(user_id, chat_id, user_answer):
     )
     '''
 
-    prompt = f"""
-        ВОПРОС: {question}
-        ПРАВИЛЬНЫЙ ОТВЕТ (эталон): {correct_answer}
-        ОТВЕТ СТУДЕНТА: {user_answer}
-
-        КРИТЕРИИ ОЦЕНКИ:
-        0-15%: Полностью неверный ответ – не относится к вопросу, только тема без объяснений, бессмысленный набор слов.
-        16-35%: Минимальное понимание – упоминается тема, но нет объяснений, 1-2 правильных факта.
-        36-55%: Частичное понимание – основная идея есть, детали неточные, 30-50% ключевых моментов, несколько ошибок.
-        56-75%: Хорошее понимание – большинство ключевых моментов раскрыты, логичная структура, минимум ошибок.
-        76-90%: Отличное понимание – тема раскрыта полностью, основные и дополнительные детали, четкая логика.
-        91-100%: Превосходное знание – исчерпывающий ответ, дополнительные примеры, глубокое понимание.
-
-        ИСКЛЮЧЕНИЕ:
-        - Когда эталон гласит что-то по типу "в источниках нет ответа / информации" или "ответ дать невозможно". В таком случае, оценивай насколько хорошо пользователь ответил на поставленный вопрос и игнорируй эталон.
-
-        ВАЖНО:
-        - Если эталон качественный, сверяй ответ с ним.
-        - Не завышай оценку за общие фразы.
-        - Учитывай полноту и точность.
-        - Оцени в процентах (0-100).
-
-        Отвечай строго в формате:
-        Оценка: <число>%
-        Рекомендация: <краткий анализ, что в ответе отсутствует и что хорошо, используя информацию из эталона>."""
-
-    
     try:
-        chat_completion = client.chat.completions.create(
-            messages=[{"role": "user", "content": prompt}],
-            model=DEFAULT_MODEL,
-        )
-        response = chat_completion.choices[0].message.content
-        response = remove_think_blocks(response)
+        response, score = grade_answer(question, correct_answer, user_answer, topic_key)
 
         # 👈 НОВОЕ: Парсим оценку и сохраняем статистику
-        score = parse_ai_score(response)
         if score is not None:
             add_score_to_question(user_id, topic_key, question, score)
             logger.info(f"Saved score {score} for user {user_id}, question: {question[:50]}...")
-        else:
-            logger.warning(f"Failed to parse score from AI response: {response[:100]}...")
         
         # Отправляем оценку и показываем клавиатуру экзамена
         send_message_safe(chat_id, f"📝 Результат:\n\n{response}", get_exam_keyboard())
@@ -473,48 +849,59 @@ def process_exam_answer(user_id, chat_id, user_answer):
     except Exception as e:
         bot.send_message(chat_id, f"❌ Ошибка при оценке ответа: {e}", reply_markup=get_exam_keyboard())
 
+theory_cache = OrderedDict()  # Ключ шаблона и вопроса -> текст теории, LRU
+theory_cache_lock = threading.Lock()
+
+def get_cached_theory(cache_key):
+    with theory_cache_lock:
+        theory = theory_cache.get(cache_key)
+        if theory is not None:
+            theory_cache.move_to_end(cache_key)
+        return theory
+
+def put_cached_theory(cache_key, theory):
+    with theory_cache_lock:
+        theory_cache[cache_key] = theory
+        theory_cache.move_to_end(cache_key)
+        if len(theory_cache) > THEORY_CACHE_LIMIT:
+            theory_cache.popitem(last=False)
+
+def get_theory(question, correct_answer, theory_type, topic_key):
+    """
+    Теория по вопросу: из кэша или запросом к ИИ.
+    Теория зависит только от вопроса и шаблона — кэш общий для всех пользователей.
+    Возвращает (текст, ключ кэша, сгенерирована ли сейчас)
+    """
+    template = get_template(f"theory_{theory_type}", topic_key)
+    cache_key = template.cache_key(question, correct_answer)
+    theory = get_cached_theory(cache_key)
+    if theory is not None:
+        return theory, cache_key, False
+    theory_completion = request_completion(
+        template, {"question": question, "correct_answer": correct_answer}, DEFAULT_MODEL)
+    theory = remove_think_blocks(theory_completion.choices[0].message.content)
+    put_cached_theory(cache_key, theory)
+    return theory, cache_key, True
+
 def show_theory(user_id, chat_id, theory_type="dry"):
     """Показ теории по вопросу"""
-    user_id_str = str(user_id)
-    question = user_exam_state[user_id_str].get("question", "")
-    
-    # Берем правильный ответ из сохраненных вопросов пользователя
+    # Берем вопрос и правильный ответ из текущего вопроса пользователя
     user_questions = get_user_questions(user_id)
-    correct_answer = user_questions.get(question, "")
+    question, correct_answer = next(iter(user_questions.items()), ("", ""))
 
-    if theory_type == "dry":
-        theory_prompt = f"""Дай точное объяснение:
-            Вопрос: {question}
-            Правильный ответ: {correct_answer}
-            Строго по шаблону из правильного ответа. Не использовать **жирный шрифт**."""
-    
-    else:
-        theory_prompt = (
-            f"Ты — преподаватель информатики. На основе следующего экзаменационного вопроса и эталонного ответа "
-            f"составь компактный, но полный конспект по теме для подготовки к экзамену. "
-            f"Излагай структурировано с подзаголовками, списками и короткими примерами кода, где уместно. Не использовать **жирный шрифт**.\n\n"
-            f"Вопрос: {question}\n"
-            f"Эталонный ответ: {correct_answer}\n\n"
-            f"Требования к структуре:\n"
-            f"1) Краткое введение в тему (1–2 предложения)\n"
-            f"2) Ключевые понятия и определения\n"
-            f"3) Основные приёмы/синтаксис/формулы (по теме)\n"
-            f"4) Короткие примеры (минимум 2)\n"
-            f"5) Частые ошибки и как их избегать\n"
-            f"6) Мини-чеклист перед экзаменом\n\n"
-            f"Выводи строго на русском языке. Заголовок: 'Теория по теме'."
-        )
+    user_id_str = str(user_id)
+    session = user_exam_state.get(user_id_str)
+    topic_key = session.topic if session else None
     
     try:
         # Сообщаем пользователю, что идёт формирование теории
         thinking_message = bot.send_message(chat_id, '🤔 Генерирую объяснение...')
 
-        theory_completion = client.chat.completions.create(
-            messages=[{"role": "user", "content": theory_prompt}],
-            model=DEFAULT_MODEL,
-        )
-        theory = theory_completion.choices[0].message.content
-        theory = remove_think_blocks(theory)
+        # Если теорию этого вопроса уже готовит предвыборка — дожидаемся её, а не дублируем запрос
+        wait_prefetched_theory(user_id_str, question, theory_type)
+        theory, cache_key, generated = get_theory(question, correct_answer, theory_type, topic_key)
+        if not generated:
+            note_theory_hit(user_id_str, cache_key)
         
         # Отправляем теорию частями, первую часть подставляем в сообщение "думаю"
         message_parts = split_message(theory)
@@ -549,25 +936,33 @@ def show_theory(user_id, chat_id, theory_type="dry"):
 def next_question(user_id, chat_id):
     """Следующий вопрос"""
     user_id_str = str(user_id)
-    topic_key = user_exam_state[user_id_str]["topic"]
+    session = user_exam_state[user_id_str]
+    topic_key = session.topic
     
     # Берем Все вопросы темы
     all_questions = load_topic_data(topic_key)
     if not all_questions:
-        bot.send_message(chat_id, "❌ Ошибка: Нет доступных вопросов.")
+        # Тема могла быть удалена или опустошена горячей перезагрузкой банков
+        user_exam_state.pop(user_id_str, None)
+        save_exam_state()
+        cancel_prefetch(user_id_str)
+        bot.send_message(
+            chat_id,
+            "⚠️ Вопросы этой темы обновились и сейчас недоступны. Экзамен завершён, выберите тему заново.",
+            reply_markup=get_main_keyboard()
+        )
         return
     
-    question = select_adaptive_question(user_id, topic_key, all_questions)
-    correct_answer = all_questions[question]
-    topic_display = user_exam_state[user_id_str]["topic_display"]
-    
-    # Обновляем состояние
-    user_exam_state[user_id_str].update({
-        "question": question,
-        "correct_answer": correct_answer,
-        "waiting_answer": True,
-        "waiting_action": False
-    })
+    question = take_prefetched_question(user_id_str, topic_key, all_questions)
+    if question is None:
+        question = select_adaptive_question(user_id, topic_key, all_questions)
+    topic_display = EXAM_TOPICS[topic_key]["display_name"]
+    
+    # Обновляем состояние (одиночный вопрос — выходим из режима билета, если он был)
+    session.question_id = get_question_hash(question)
+    session.phase = PHASE_ANSWER
+    session.ticket = None
+    session.answers = []
     save_exam_state()  # Сохраняем изменения
 
     score = get_average_score(user_id, topic_key, question)
@@ -586,6 +981,7 @@ def end_exam(user_id, chat_id):
     # Просто удаляем состояние - все данные автоматически исчезают
     user_exam_state.pop(user_id_str, None)
     save_exam_state()
+    cancel_prefetch(user_id_str)
     
     bot.send_message(
         chat_id,
@@ -594,6 +990,442 @@ def end_exam(user_id, chat_id):
     )
 
 
+# ======================== ПРЕДВЫБОРКА ========================
+
+class Prefetch:
+    """Заранее выбранный вопрос пользователя и фоновые задачи прогрева его теории"""
+    __slots__ = ("topic", "question", "correct_answer", "futures", "unused_theory", "retired")
+
+    def __init__(self, topic, question, correct_answer):
+        self.topic = topic
+        self.question = question
+        self.correct_answer = correct_answer
+        self.futures = {}  # Тип теории -> Future
+        self.unused_theory = set()  # Ключи теории, сгенерированной заранее и ещё не показанной
+        self.retired = False
+
+prefetch_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+prefetch_lock = threading.Lock()
+prefetch_next = {}  # user_id -> Prefetch следующего вопроса, ещё не выданного
+prefetch_current = {}  # user_id -> Prefetch выданного вопроса, теорию которого ещё могут запросить
+prefetch_pending = 0  # Задач прогрева в очереди и в работе
+prefetch_metrics = {
+    "questions": 0,       # Вопросов выбрано заранее
+    "question_hits": 0,   # Из них выдано пользователю
+    "theory_calls": 0,    # Запросов теории, сделанных предвыборкой
+    "theory_hits": 0,     # Из них показано пользователю
+    "wasted_calls": 0,    # Из них так и не понадобилось
+    "cancelled": 0,       # Задач снято до начала работы
+    "over_budget": 0,     # Задач не поставлено из-за бюджета
+}
+
+def start_prefetch(user_id, topic_key):
+    """Выбирает следующий вопрос адаптивным сэмплером и ставит прогрев его теории в фоновый пул"""
+    global prefetch_pending
+    user_id_str = str(user_id)
+    all_questions = load_topic_data(topic_key)
+    if not all_questions:
+        return
+    question = select_adaptive_question(user_id, topic_key, all_questions)
+    prefetch = Prefetch(topic_key, question, all_questions[question])
+
+    with prefetch_lock:
+        previous = prefetch_next.pop(user_id_str, None)
+        prefetch_next[user_id_str] = prefetch
+        prefetch_metrics["questions"] += 1
+    retire_prefetch(previous)
+
+    for theory_type in PREFETCH_THEORY_TYPES:
+        with prefetch_lock:
+            if prefetch_pending >= PREFETCH_MAX_PENDING:
+                prefetch_metrics["over_budget"] += 1
+                continue
+            prefetch_pending += 1
+        prefetch.futures[theory_type] = prefetch_executor.submit(warm_theory, prefetch, theory_type)
+
+def warm_theory(prefetch, theory_type):
+    """Фоновая задача: генерирует теорию в общий кэш, если предвыборка ещё актуальна"""
+    global prefetch_pending
+    try:
+        if prefetch.retired:
+            return
+        _, cache_key, generated = get_theory(
+            prefetch.question, prefetch.correct_answer, theory_type, prefetch.topic)
+        if generated:
+            with prefetch_lock:
+                prefetch_metrics["theory_calls"] += 1
+                if prefetch.retired:
+                    prefetch_metrics["wasted_calls"] += 1
+                else:
+                    prefetch.unused_theory.add(cache_key)
+    except Exception as e:
+        logger.error(f"Ошибка предвыборки теории: {e}")
+    finally:
+        with prefetch_lock:
+            prefetch_pending -= 1
+
+def retire_prefetch(prefetch):
+    """Снимает ждущие задачи; заранее сгенерированная и не показанная теория уходит в потери"""
+    global prefetch_pending
+    if prefetch is None:
+        return
+    with prefetch_lock:
+        futures = list(prefetch.futures.values())
+        prefetch.futures.clear()
+    # cancel() возвращает True и для уже снятой задачи — считаем только снятые здесь
+    cancelled = sum(1 for future in futures if not future.cancelled() and future.cancel())
+    with prefetch_lock:
+        prefetch.retired = True
+        prefetch_pending -= cancelled
+        prefetch_metrics["cancelled"] += cancelled
+        prefetch_metrics["wasted_calls"] += len(prefetch.unused_theory)
+        prefetch.unused_theory.clear()
+
+def take_prefetched_question(user_id_str, topic_key, all_questions):
+    """Заранее выбранный вопрос, если он ещё подходит; иначе None"""
+    with prefetch_lock:
+        prefetch = prefetch_next.pop(user_id_str, None)
+        previous = prefetch_current.pop(user_id_str, None)
+        usable = (prefetch is not None and prefetch.topic == topic_key
+                  and prefetch.question in all_questions)
+        if usable:
+            prefetch_current[user_id_str] = prefetch
+            prefetch_metrics["question_hits"] += 1
+    retire_prefetch(previous)
+    if not usable:
+        retire_prefetch(prefetch)
+        return None
+    return prefetch.question
+
+def wait_prefetched_theory(user_id_str, question, theory_type):
+    """Дожидается прогрева теории текущего вопроса; ещё не начатую задачу снимает"""
+    global prefetch_pending
+    with prefetch_lock:
+        prefetch = prefetch_current.get(user_id_str)
+        if prefetch is None or prefetch.question != question:
+            return
+        # Забираем задачу из Prefetch: снять её может только тот, кто её забрал
+        future = prefetch.futures.pop(theory_type, None)
+    if future is None:
+        return
+    if future.cancel():
+        # Задача ещё в очереди — быстрее сгенерировать теорию сразу
+        with prefetch_lock:
+            prefetch_pending -= 1
+            prefetch_metrics["cancelled"] += 1
+        return
+    future.result()
+
+def note_theory_hit(user_id_str, cache_key):
+    """Учитывает показ теории, подготовленной предвыборкой"""
+    with prefetch_lock:
+        prefetch = prefetch_current.get(user_id_str)
+        if prefetch is not None and cache_key in prefetch.unused_theory:
+            prefetch.unused_theory.discard(cache_key)
+            prefetch_metrics["theory_hits"] += 1
+
+def cancel_prefetch(user_id_str):
+    """Сброс предвыборки при завершении или смене экзамена"""
+    with prefetch_lock:
+        pending = prefetch_next.pop(user_id_str, None)
+        current = prefetch_current.pop(user_id_str, None)
+    retire_prefetch(pending)
+    retire_prefetch(current)
+
+def format_prefetch_metrics():
+    """Сводка по предвыборке для админов"""
+    with prefetch_lock:
+        metrics = dict(prefetch_metrics)
+    question_rate = metrics["question_hits"] / metrics["questions"] * 100 if metrics["questions"] else 0
+    theory_rate = metrics["theory_hits"] / metrics["theory_calls"] * 100 if metrics["theory_calls"] else 0
+    return (
+        f"🔮 Предвыборка:\n\n"
+        f"Вопросов выбрано заранее: {metrics['questions']}, выдано: {metrics['question_hits']} "
+        f"({question_rate:.0f}%)\n"
+        f"Теория: запросов {metrics['theory_calls']}, показано {metrics['theory_hits']} "
+        f"({theory_rate:.0f}%), впустую {metrics['wasted_calls']}\n"
+        f"Снято задач: {metrics['cancelled']}, не поставлено из-за бюджета: {metrics['over_budget']}"
+    )
+
+# ======================== БИЛЕТЫ ========================
+
+def start_ticket(user_id, chat_id, topic_key):
+    """Билет: TICKET_SIZE разных вопросов, ответы собираются и оцениваются одним запросом"""
+    user_id_str = str(user_id)
+    cancel_prefetch(user_id_str)
+    
+    all_questions = load_topic_data(topic_key)
+    if not all_questions:
+        user_exam_state.pop(user_id_str, None)
+        save_exam_state()
+        bot.send_message(chat_id, "❌ Ошибка: Нет доступных вопросов.", reply_markup=get_main_keyboard())
+        return
+    
+    # Тянем вопросы адаптивно, без повторов внутри билета
+    remaining = dict(all_questions)
+    ticket = []
+    for _ in range(min(TICKET_SIZE, len(remaining))):
+        question = select_adaptive_question(user_id, topic_key, remaining)
+        remaining.pop(question)
+        ticket.append(question)
+    
+    user_exam_state[user_id_str] = ExamSession(
+        topic=topic_key,
+        question_id=get_question_hash(ticket[0]),
+        phase=PHASE_ANSWER,
+        start_time=int(time.time()),
+        ticket=[get_question_hash(question) for question in ticket],
+    )
+    save_exam_state()
+    
+    bot.send_message(
+        chat_id,
+        f"🎫 Билет начат!\n\n"
+        f"Тема: {EXAM_TOPICS[topic_key]['display_name']}\n"
+        f"Ответьте на {len(ticket)} вопроса(ов) — оценка придёт одним сообщением.\n\n"
+        f"📋 Вопрос 1/{len(ticket)}:\n{ticket[0]}\n\n"
+        f"💬 Введите ваш ответ:",
+        reply_markup=get_hidden_keyboard()
+    )
+
+def process_ticket_answer(user_id, chat_id, user_answer):
+    """Сохраняет ответ на вопрос билета; после последнего — проверка всего билета"""
+    user_id_str = str(user_id)
+    session = user_exam_state[user_id_str]
+    session.answers.append(user_answer)
+    
+    answered = len(session.answers)
+    if answered < len(session.ticket):
+        session.question_id = session.ticket[answered]
+        save_exam_state()
+        question = get_question_by_id(session.topic, session.question_id)[0] or "(вопрос убрали из банка, ответьте что угодно)"
+        bot.send_message(
+            chat_id,
+            f"📋 Вопрос {answered + 1}/{len(session.ticket)}:\n\n{question}\n\n💬 Введите ваш ответ:",
+            reply_markup=get_hidden_keyboard()
+        )
+        return
+    
+    session.phase = PHASE_ACTION
+    save_exam_state()
+    grade_ticket(user_id, chat_id, session)
+
+def grade_ticket(user_id, chat_id, session):
+    """Оценка билета одним запросом; вопросы, которые не удалось разобрать, оцениваются по одному"""
+    user_id_str = str(user_id)
+    items = []
+    for question_id, user_answer in zip(session.ticket, session.answers):
+        question, correct_answer = get_question_by_id(session.topic, question_id)
+        if question is not None:  # Удалённые из банка вопросы не оцениваем
+            items.append((question, correct_answer, user_answer))
+    
+    try:
+        results = grade_answers_batch(items, session.topic)
+    except Exception as e:
+        logger.error(f"Ошибка пакетной оценки билета: {e}")
+        results = [None] * len(items)
+    
+    sections = []
+    for number, ((question, correct_answer, user_answer), result) in enumerate(zip(items, results), 1):
+        if result is None:
+            # Запасной путь: отдельный запрос на вопрос
+            try:
+                result = grade_answer(question, correct_answer, user_answer, session.topic)
+            except Exception as e:
+                result = (f"❌ Ошибка при оценке ответа: {e}", None)
+        response, score = result
+        
+        user_stats[user_id_str].exam_answered += 1
+        if score is not None:
+            add_score_to_question(user_id, session.topic, question, score)
+        sections.append(f"📋 Вопрос {number}: {question}\n\n{response}")
+    save_user_stats()
+    
+    message_parts = split_message("📝 Результат билета:\n\n" + "\n\n".join(sections))
+    for part in message_parts[:-1]:
+        send_message_safe(chat_id, part)
+    send_message_safe(chat_id, message_parts[-1], get_ticket_keyboard())
+
+def grade_answers_batch(items, topic_key=None):
+    """
+    Оценивает [(вопрос, эталон, ответ)] одним запросом к ИИ.
+    Возвращает список (текст, балл) по вопросам; None там, где оценка не прошла схему.
+    """
+    if not items:
+        return []
+    blocks = "\n\n".join(
+        BATCH_ITEM.format(number=number, question=question,
+                          correct_answer=correct_answer, user_answer=user_answer)
+        for number, (question, correct_answer, user_answer) in enumerate(items, 1)
+    )
+    fields = {"count": len(items), "items": blocks}
+
+    max_tokens = GRADING_BATCH_TOKENS_PER_ITEM * (len(items) + 1)
+    grades = request_grade(get_template("grade_batch", topic_key), fields, max_tokens,
+                           lambda data: validate_batch_grades(data, len(items)))
+    if grades is None:
+        return [None] * len(items)
+    record_grading_metrics(item_failures=grades.count(None))
+    return [(format_grade(grade), grade["score"]) if grade else None for grade in grades]
+
+def validate_batch_grades(data, count):
+    """
+    Проверяет пакетную оценку {"results": [{"number": N, ...оценка}]}.
+    None — ответ непригоден целиком (в том числе когда схему не прошёл ни один вопрос:
+    тогда это ошибка разбора и нужна починка); иначе список оценок с None для непрошедших
+    """
+    results = data.get("results") if isinstance(data, dict) else None
+    if not isinstance(results, list):
+        return None
+    grades = [None] * count
+    for item in results:
+        number = item.get("number") if isinstance(item, dict) else None
+        if isinstance(number, int) and 1 <= number <= count and grades[number - 1] is None:
+            grades[number - 1] = validate_grade(item)
+    if all(grade is None for grade in grades):
+        return None
+    return grades
+
+def process_answer(user_id, chat_id, user_answer):
+    """Ответ на текущий вопрос: в билете — копим ответы, иначе — оцениваем сразу"""
+    user_id_str = str(user_id)
+    if not try_begin_grading(user_id_str):
+        bot.send_message(chat_id, "⏳ Предыдущий ответ ещё проверяется, дождитесь результата.")
+        return
+    try:
+        if user_exam_state[user_id_str].ticket is not None:
+            process_ticket_answer(user_id, chat_id, user_answer)
+        else:
+            process_exam_answer(user_id, chat_id, user_answer)
+    finally:
+        end_grading(user_id_str)
+
+
+# ======================== ПЕРЕЗАГРУЗКА БАНКОВ ========================
+
+def get_file_mtime(filename):
+    """mtime файла или None, если файла нет"""
+    try:
+        return os.stat(filename).st_mtime_ns
+    except OSError:
+        return None
+
+def read_bank_strict(filename):
+    """
+    Строгое чтение банка вопросов: в отличие от load_data бросает исключение
+    на битом файле, чтобы недописанный JSON не подменил рабочий банк пустым
+    """
+    with open(filename, "r", encoding='utf-8') as file:
+        data = json.load(file)
+    if not isinstance(data, dict) or not all(
+            isinstance(q, str) and isinstance(a, str) for q, a in data.items()):
+        raise ValueError("ожидается объект {вопрос: ответ}")
+    return data
+
+def load_topics_config():
+    """Темы по умолчанию + необязательный theory/topics.json (null удаляет тему)"""
+    topics = dict(DEFAULT_EXAM_TOPICS)
+    if get_file_mtime(TOPICS_FILE) is None:
+        return topics
+    with open(TOPICS_FILE, "r", encoding='utf-8') as file:
+        overrides = json.load(file)
+    for topic_key, topic_data in overrides.items():
+        if topic_data is None:
+            topics.pop(topic_key, None)
+        elif "questions_file" in topic_data and "display_name" in topic_data:
+            topics[topic_key] = topic_data
+        else:
+            raise ValueError(f"тема {topic_key}: нужны questions_file и display_name")
+    return topics
+
+def reload_topic(topic_key):
+    """
+    Перечитывает банк темы и атомарно подменяет его в кэше.
+    ID вопросов — хеш текста, поэтому у неизменённых вопросов они сохраняются,
+    и оценки в user_question_stats остаются привязанными.
+    Возвращает (добавлено, удалено, изменено) или None при ошибке.
+    """
+    questions_file = EXAM_TOPICS[topic_key]["questions_file"]
+    mtime = get_file_mtime(questions_file)
+    try:
+        new_data = read_bank_strict(questions_file) if mtime is not None else {}
+    except Exception as e:
+        logger.error(f"Банк {questions_file} не перезагружен, оставлена старая версия: {e}")
+        bank_mtimes[questions_file] = mtime  # Не повторяем попытку до следующего изменения
+        return None
+
+    old_data = topic_cache.get(topic_key, {})
+    added = len(new_data.keys() - old_data.keys())
+    removed = len(old_data.keys() - new_data.keys())
+    changed = sum(1 for q in new_data.keys() & old_data.keys() if new_data[q] != old_data[q])
+
+    # Удалённые вопросы остаются доступны активным сессиям по их ID
+    for question in old_data.keys() - new_data.keys():
+        retired_questions[get_question_hash(question)] = (question, old_data[question])
+
+    topic_index[topic_key] = build_topic_index(new_data)
+    topic_cache[topic_key] = new_data  # Атомарная подмена ссылки
+    bank_mtimes[questions_file] = mtime
+    load_question_difficulty(topic_key)  # Новая тема сразу получает общий средний балл
+    return added, removed, changed
+
+def reload_banks(force=False):
+    """
+    Проверяет список тем и файлы банков, перезагружает изменившиеся.
+    Возвращает {topic_key: (добавлено, удалено, изменено)} по перезагруженным темам.
+    """
+    global EXAM_TOPICS
+    summary = {}
+    with bank_reload_lock:
+        topics_mtime = get_file_mtime(TOPICS_FILE)
+        if force or topics_mtime != bank_mtimes.get(TOPICS_FILE):
+            try:
+                new_topics = load_topics_config()
+            except Exception as e:
+                logger.error(f"{TOPICS_FILE} не применён: {e}")
+                new_topics = EXAM_TOPICS
+            else:
+                bank_mtimes[TOPICS_FILE] = topics_mtime
+            for topic_key in EXAM_TOPICS.keys() - new_topics.keys():
+                topic_cache.pop(topic_key, None)
+                topic_index.pop(topic_key, None)
+                summary[topic_key] = None
+            EXAM_TOPICS = new_topics
+
+        for topic_key, topic_data in list(EXAM_TOPICS.items()):
+            questions_file = topic_data["questions_file"]
+            if (force or topic_key not in topic_cache
+                    or get_file_mtime(questions_file) != bank_mtimes.get(questions_file)):
+                result = reload_topic(topic_key)
+                if result is not None:
+                    summary[topic_key] = result
+    return summary
+
+def format_reload_summary(summary):
+    """Текстовый отчёт о перезагрузке банков"""
+    if not summary:
+        return "Изменений в банках вопросов нет."
+    lines = []
+    for topic_key, result in summary.items():
+        if result is None:
+            lines.append(f"• {topic_key}: тема удалена")
+        else:
+            added, removed, changed = result
+            lines.append(f"• {topic_key}: +{added} −{removed} ~{changed}")
+    return "\n".join(lines)
+
+def bank_watcher():
+    """Фоновый поток: следит за файлами банков и подгружает изменения"""
+    while True:
+        time.sleep(BANK_RELOAD_INTERVAL)
+        try:
+            summary = reload_banks()
+            if summary:
+                logger.warning(f"Банки вопросов перезагружены:\n{format_reload_summary(summary)}")
+        except Exception as e:
+            logger.error(f"Ошибка перезагрузки банков: {e}")
+
+
 # ======================== ОБРАБОТЧИКИ КОМАНД ========================
 
 @bot.message_handler(commands=['start'])
@@ -619,7 +1451,9 @@ def cmd_help(message: Message):
     help_text = (
         "📖 Справка по командам:\n\n"
         "🎯 `/exam` — начать экзамен\n"
+        "🎫 `/ticket` — билет из нескольких вопросов с общей проверкой\n"
         "📊 `/settings` — статистика и настройки\n"
+        "📈 `/progress` — прогресс по темам и слабые вопросы\n"
         "🗑 `/clear` — очистить историю диалога\n"
         "❌ `/cancel_exam` — отменить текущий экзамен\n\n"
         "Или используйте кнопки на клавиатуре!"
@@ -642,26 +1476,42 @@ def cmd_settings(message: Message):
     
     stats_text = (
         f"📊 Ваша статистика:\n\n"
-        f"👤 Пользователь: {stats['username']}\n"
-        f"💬 Текстовые запросы: {stats['text_requests']}\n"
-        f"🎤 Голосовые запросы: {stats['voice_requests']}\n"
+        f"👤 Пользователь: {stats.username}\n"
+        f"💬 Текстовые запросы: {stats.text_requests}\n"
+        f"🎤 Голосовые запросы: {stats.voice_requests}\n"
         f"🧠 Модель ИИ: {DEFAULT_MODEL}\n"
-        f"📝 Экзаменационных ответов: {stats.get('exam_answered', 0)}"
+        f"📝 Экзаменационных ответов: {stats.exam_answered}\n\n"
+        f"📈 Прогресс по темам: /progress"
     )
     
     send_message_safe(message.chat.id, stats_text, get_main_keyboard())
 
+@bot.message_handler(commands=['progress'])
+def cmd_progress(message: Message):
+    user_id = message.from_user.id
+    initialize_user(user_id, message.from_user.__dict__)
+    send_message_safe(message.chat.id, format_progress_report(user_id), get_main_keyboard())
+
 @bot.message_handler(commands=['exam'])
 def cmd_exam(message: Message):
+    choose_topic(message, ticket=False)
+
+@bot.message_handler(commands=['ticket'])
+def cmd_ticket(message: Message):
+    choose_topic(message, ticket=True)
+
+def choose_topic(message: Message, ticket):
+    """Выбор темы для экзамена или билета"""
     user_id = message.from_user.id
     initialize_user(user_id, message.from_user.__dict__)
     
     user_id_str = str(user_id)
     
     # Проверяем активный экзамен
-    if user_id_str in user_exam_state and user_exam_state[user_id_str].get("waiting_answer"):
-        current_question = user_exam_state[user_id_str]["question"]
-        current_topic = user_exam_state[user_id_str].get("topic_display", "Неизвестно")
+    if user_id_str in user_exam_state and user_exam_state[user_id_str].waiting_answer:
+        session = user_exam_state[user_id_str]
+        current_question = get_question_by_id(session.topic, session.question_id)[0] or ""
+        current_topic = EXAM_TOPICS.get(session.topic, {}).get("display_name", "Неизвестно")
         bot.send_message(
             message.chat.id,
             f"❗ У вас есть незавершенный экзамен!\n\n"
@@ -672,9 +1522,10 @@ def cmd_exam(message: Message):
         )
         return
     
-    # Показываем выбор темы
-    user_exam_state[user_id_str] = {"waiting_topic": True}
+    # Показываем выбор темы; пустой список билета — признак режима билета
+    user_exam_state[user_id_str] = ExamSession(ticket=[] if ticket else None)
     save_exam_state()
+    cancel_prefetch(user_id_str)  # Экзамен в фазе действия заменён выбором темы
     
     topics_text = "🎯 Выберите тему для экзамена:\n\n"
     for topic_key, topic_data in EXAM_TOPICS.items():
@@ -692,10 +1543,31 @@ def cmd_cancel_exam(message: Message):
     if user_id_str in user_exam_state:
         user_exam_state.pop(user_id_str)
         save_exam_state()
+        cancel_prefetch(user_id_str)
         bot.send_message(message.chat.id, "❌ Экзамен отменен!", reply_markup=get_main_keyboard())
     else:
         bot.send_message(message.chat.id, "❌ У вас нет активного экзамена.", reply_markup=get_main_keyboard())
 
+@bot.message_handler(commands=['grading_stats'])
+def cmd_grading_stats(message: Message):
+    """Метрики оценивания: ошибки разбора и выходные токены (только для админов)"""
+    if message.from_user.id not in ADMIN_IDS:
+        bot.send_message(message.chat.id, "❌ Команда доступна только администраторам.")
+        return
+    send_message_safe(message.chat.id,
+                      f"{format_grading_metrics()}\n\n{format_coalesce_metrics()}\n\n"
+                      f"{format_prefetch_metrics()}\n\n{format_usage()}")
+
+@bot.message_handler(commands=['reload_banks'])
+def cmd_reload_banks(message: Message):
+    """Принудительная перезагрузка банков вопросов (только для админов)"""
+    if message.from_user.id not in ADMIN_IDS:
+        bot.send_message(message.chat.id, "❌ Команда доступна только администраторам.")
+        return
+
+    summary = reload_banks(force=True)
+    bot.send_message(message.chat.id, f"🔄 Банки вопросов перезагружены:\n\n{format_reload_summary(summary)}")
+
 # ======================== ОБРАБОТЧИК ТЕКСТА ========================
 
 @bot.message_handler(content_types=['text'])
@@ -710,7 +1582,7 @@ def handle_text(message: Message):
     initialize_user(user_id, message.from_user.__dict__)
 
     # Обработка выбора темы
-    if user_id_str in user_exam_state and user_exam_state[user_id_str].get("waiting_topic"):
+    if user_id_str in user_exam_state and user_exam_state[user_id_str].waiting_topic:
         # Ищем тему по display_name
         selected_topic = None
         for topic_key, topic_data in EXAM_TOPICS.items():
@@ -719,12 +1591,15 @@ def handle_text(message: Message):
                 break
         
         if selected_topic:
-            user_exam_state[user_id_str].pop("waiting_topic", None)
-            start_exam(user_id, message.chat.id, selected_topic)  # 👈 Теперь с topic_key!
+            if user_exam_state[user_id_str].ticket is not None:
+                start_ticket(user_id, message.chat.id, selected_topic)
+            else:
+                start_exam(user_id, message.chat.id, selected_topic)  # 👈 Теперь с topic_key!
             return
         elif text == "🔙 Назад в меню":
             user_exam_state.pop(user_id_str, None)
             save_exam_state()
+            cancel_prefetch(user_id_str)
             send_message_safe(message.chat.id, "↩️ Возврат в главное меню", get_main_keyboard())
             return
         else:
@@ -736,25 +1611,49 @@ def handle_text(message: Message):
         cmd_exam(message)
         return
     
+    elif text == "🎫 Билет":
+        cmd_ticket(message)
+        return
+    
     elif text == "📊 Статистика":
         cmd_settings(message)
         return
     
+    elif text == "📈 Прогресс":
+        cmd_progress(message)
+        return
+    
     elif text == "🗑 Очистить историю":
         cmd_clear(message)
         return
     
+    # Пока проверяется ответ, не запускаем ни повторную проверку, ни чат с ИИ
+    if is_grading(user_id_str):
+        bot.send_message(message.chat.id, "⏳ Проверяю ваш ответ, подождите немного.")
+        return
+    
     # Обработка экзамена
     if user_id_str in user_exam_state:
         exam_state = user_exam_state[user_id_str]
         
         # Если ждем ответ на вопрос
-        if exam_state.get("waiting_answer"):
-            process_exam_answer(user_id, message.chat.id, text)
+        if exam_state.waiting_answer:
+            process_answer(user_id, message.chat.id, text)
             return
         
+        # После проверки билета — только кнопки билета: теория и «следующий вопрос»
+        # относятся к одиночному вопросу и перепутали бы состояние билета
+        elif exam_state.waiting_action and exam_state.ticket is not None:
+            if text == "🎫 Следующий билет":
+                start_ticket(user_id, message.chat.id, exam_state.topic)
+                return
+            
+            elif text == "❌ Завершить экзамен":
+                end_exam(user_id, message.chat.id)
+                return
+        
         # Если ждем действие после ответа
-        elif exam_state.get("waiting_action"):            
+        elif exam_state.waiting_action:            
             if text == "📚 Теория (классика)":
                 show_theory(user_id, message.chat.id, "dry")
                 return
@@ -767,15 +1666,44 @@ def handle_text(message: Message):
                 next_question(user_id, message.chat.id)
                 return
             
+            elif text == "🎫 Следующий билет":
+                start_ticket(user_id, message.chat.id, exam_state.topic)
+                return
+            
             elif text == "❌ Завершить экзамен":
                 end_exam(user_id, message.chat.id)
                 return
     
     # Обычное общение с ИИ
-    user_stats[user_id_str]["text_requests"] += 1
-    save_data(USER_STATS_FILE, user_stats)
+    user_stats[user_id_str].text_requests += 1
+    save_user_stats()
     
-    sent_message = bot.send_message(message.chat.id, '🤔 Думаю...')
+    # Пока идёт запрос к ИИ, новые сообщения копятся и уходят одним запросом после него
+    with coalesce_lock:
+        if user_id_str in chat_pending:
+            chat_pending[user_id_str].append(text)
+            coalesce_metrics["coalesced_chat"] += 1
+            return
+        chat_pending[user_id_str] = []
+    
+    try:
+        while True:
+            chat_with_ai(message.chat.id, user_id_str, text)
+            with coalesce_lock:
+                pending = chat_pending[user_id_str]
+                if not pending:
+                    del chat_pending[user_id_str]
+                    break
+                chat_pending[user_id_str] = []
+            text = "\n\n".join(pending)
+    except Exception:
+        with coalesce_lock:
+            chat_pending.pop(user_id_str, None)
+        raise
+
+def chat_with_ai(chat_id, user_id_str, text):
+    """Один запрос к ИИ в режиме свободного общения"""
+    sent_message = bot.send_message(chat_id, '🤔 Думаю...')
     
     # Сохраняем сообщение пользователя
     new_message = {"role": "user", "content": text}
@@ -806,24 +1734,24 @@ def handle_text(message: Message):
         # Редактируем первое сообщение
         try:
             bot.edit_message_text(
-                chat_id=message.chat.id,
+                chat_id=chat_id,
                 message_id=sent_message.message_id,
                 text=message_parts[0],
                 parse_mode='Markdown'
             )
         except:
             bot.edit_message_text(
-                chat_id=message.chat.id,
+                chat_id=chat_id,
                 message_id=sent_message.message_id,
                 text=message_parts[0]
             )
         
         # Отправляем остальные части
         for part in message_parts[1:]:
-            send_message_safe(message.chat.id, part)
+            send_message_safe(chat_id, part)
             
     except Exception as e:
-        bot.send_message(message.chat.id, f"❌ Ошибка: {str(e)}\n\nИспользуйте /clear для сброса контекста.")
+        bot.send_message(chat_id, f"❌ Ошибка: {str(e)}\n\nИспользуйте /clear для сброса контекста.")
 
 # ======================== ОБРАБОТЧИК ГОЛОСА ========================
 
@@ -837,19 +1765,23 @@ def handle_voice(message: Message):
     if message.voice.file_size > 10 * 1024 * 1024:  # 10MB
         bot.send_message(message.chat.id, "❌ Файл слишком большой")
         return
+    
+    if is_grading(user_id_str):
+        bot.send_message(message.chat.id, "⏳ Проверяю ваш ответ, подождите немного.")
+        return
 
-    user_stats[user_id_str]["voice_requests"] += 1
-    save_data(USER_STATS_FILE, user_stats)
+    user_stats[user_id_str].voice_requests += 1
+    save_user_stats()
 
     try:
         # Получаем информацию о голосовом файле
         voice_file_info = bot.get_file(message.voice.file_id)
-        voice_file = requests.get(f'https://api.telegram.org/file/bot{TOKEN_TG}/{voice_file_info.file_path}')
+        voice_content = bot.download_file(voice_file_info.file_path)
         
         # Сохраняем временно
         voice_filename = f"voice_{user_id}_{int(time.time())}.ogg"
         with open(voice_filename, 'wb') as f:
-            f.write(voice_file.content)
+            f.write(voice_content)
 
         # Транскрибируем
         with open(voice_filename, 'rb') as f:
@@ -871,8 +1803,8 @@ def handle_voice(message: Message):
         # Исправление транскрипции и дальнейшая обработка
         corrected_text = correct_transcription(transcribed_text)
 
-        if user_id_str in user_exam_state and user_exam_state[user_id_str].get("waiting_answer"):
-            process_exam_answer(user_id, message.chat.id, corrected_text)
+        if user_id_str in user_exam_state and user_exam_state[user_id_str].waiting_answer:
+            process_answer(user_id, message.chat.id, corrected_text)
             return
 
         # Показываем пользователю что было исправлено (если есть изменения)
@@ -884,8 +1816,8 @@ def handle_voice(message: Message):
             )
 
         # ЭКЗАМЕН: обработка ответа с исправленным текстом
-        if user_id_str in user_exam_state and user_exam_state[user_id_str].get("waiting_answer"):
-            process_exam_answer(user_id, message.chat.id, corrected_text)
+        if user_id_str in user_exam_state and user_exam_state[user_id_str].waiting_answer:
+            process_answer(user_id, message.chat.id, corrected_text)
             return
 
         # Создаем виртуальное сообщение и передаем в handle_text
@@ -906,24 +1838,81 @@ def handle_voice(message: Message):
 
 # ======================== ЗАПУСК ========================
 
+def timed(stage, func, *args):
+    """Вызов с записью длительности в startup_timings"""
+    started = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        startup_timings[stage] = time.perf_counter() - started
+
+def format_startup_timings(stages):
+    """Разбивка времени старта по этапам, в мс"""
+    return ", ".join(f"{stage}: {startup_timings[stage] * 1000:.0f} мс"
+                     for stage in stages if stage in startup_timings)
+
 def set_commands():
-    """Установка команд бота"""
+    """Установка команд бота; пропускается, если список не менялся с прошлого запуска"""
     commands = [
         BotCommand(command="start", description="Начать работу с ботом"),
         BotCommand(command="help", description="Справка по командам"),
         BotCommand(command="exam", description="Начать экзамен"),
+        BotCommand(command="ticket", description="Билет из нескольких вопросов"),
         BotCommand(command="settings", description="Статистика и настройки"),
+        BotCommand(command="progress", description="Прогресс по темам"),
         BotCommand(command="clear", description="Очистить историю диалога"),
         BotCommand(command="cancel_exam", description="Отменить экзамен"),
     ]
+    # Токен входит в хеш: для другого бота команды ставятся заново
+    payload = json.dumps([TOKEN_TG] + [command.to_dict() for command in commands], ensure_ascii=False)
+    commands_hash = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    try:
+        with open(COMMANDS_HASH_FILE, "r", encoding='utf-8') as file:
+            if file.read().strip() == commands_hash:
+                return False
+    except OSError:
+        pass
     bot.set_my_commands(commands)
+    write_atomic(COMMANDS_HASH_FILE, commands_hash.encode('utf-8'))
+    return True
+
+def warm_up():
+    """
+    Некритичный прогрев, идущий параллельно с обработкой апдейтов: банки вопросов
+    и индексы (до их загрузки темы подгружаются по первому запросу), импорт groq,
+    команды бота. Затем поток остаётся наблюдателем за банками.
+    """
+    stages = [
+        ("банки вопросов", reload_banks),
+        ("индексы сложности", lambda: [load_question_difficulty(topic_key) for topic_key in list(EXAM_TOPICS)]),
+        ("клиент Groq", lambda: client.chat),
+        ("команды бота", set_commands),
+    ]
+    for stage, func in stages:
+        try:
+            timed(stage, func)
+        except Exception as e:
+            # URL запросов к Bot API содержит токен
+            logger.error(f"Прогрев, этап «{stage}»: {str(e).replace(TOKEN_TG, '***')}")
+    print(f"🔥 Прогрев завершён: {format_startup_timings(stage for stage, _ in stages)}")
+    bank_watcher()
+
+def start_warm_up():
+    """Запуск прогрева в фоне; поток затем следит за банками"""
+    thread = threading.Thread(target=warm_up, name="bank-watcher", daemon=True)
+    thread.start()
+    return thread
 
 if __name__ == '__main__':
+    startup_timings["импорты"] = time.perf_counter() - STARTUP_STARTED
     print("🚀 Загрузка данных...")
-    load_all_data()
-    print("📋 Установка команд...")
-    set_commands()
+    timed("состояние", load_all_data)
+    start_warm_up()
+    startup_timings["до готовности"] = time.perf_counter() - STARTUP_STARTED
     print("✅ Бот запущен и готов к работе!")
+    print("⏱ Старт: " + format_startup_timings([
+        "импорты", USER_MESSAGES_FILE, USER_STATS_FILE, EXAM_STATE_FILE,
+        USER_QUESTION_STATS_FILE, "агрегаты освоения", "состояние", "до готовности"]))
 
     while True:
         try:
@@ -0,0 +1,257 @@
+"""
+Выгрузка и сводки по статистике студентов без загрузки хранилищ в память.
+
+Хранилища читаются потоково: user_question_stats.json — по одному пользователю,
+user_stats.bin — по одной записи. ID вопросов сопоставляются с текстом по банкам
+тем, поэтому память зависит от размера банков, но не от числа студентов и оценок.
+
+Отчёты:
+    scores   — оценки: пользователь, тема, вопрос, число оценок, последняя и средняя
+    users    — счётчики запросов пользователей
+    topics   — сводка по темам: студентов, вопросов, оценок, средний балл
+    hardest  — самые трудные вопросы по среднему баллу студентов
+
+Пример:
+    python export-stats.py topics
+    python export-stats.py hardest --limit 20 --min-students 3
+    python export-stats.py scores -o scores.csv
+    python export-stats.py scores --format parquet -o scores.parquet   # нужен pyarrow
+"""
+import argparse
+import csv
+import glob
+import heapq
+import itertools
+import json
+import os
+import sys
+
+from storage import get_question_hash, iter_json_items, iter_stats
+
+USER_STATS_FILE = "user_stats.bin"
+LEGACY_USER_STATS_FILE = "user_stats.json"
+USER_QUESTION_STATS_FILE = "user_question_stats.json"
+THEORY_DIR = "theory"
+TOPICS_FILE = os.path.join(THEORY_DIR, "topics.json")
+PARQUET_BATCH_ROWS = 10000
+
+# ======================== ИСТОЧНИКИ ========================
+
+def find_bank_files(data_dir):
+    """Файлы банков: theory/*.json и questions_file из theory/topics.json"""
+    files = {
+        path for path in glob.glob(os.path.join(data_dir, THEORY_DIR, "*.json"))
+        if not path.endswith(".difficulty.json") and os.path.basename(path) != "topics.json"
+    }
+    topics_file = os.path.join(data_dir, TOPICS_FILE)
+    if os.path.exists(topics_file):
+        with open(topics_file, "r", encoding='utf-8') as file:
+            for topic_data in json.load(file).values():
+                if topic_data and "questions_file" in topic_data:
+                    files.add(os.path.join(data_dir, topic_data["questions_file"]))
+    return sorted(files)
+
+
+def load_question_index(data_dir):
+    """ID вопроса -> текст по всем банкам; ID — хеш текста, поэтому тема для сопоставления не нужна"""
+    index = {}
+    for path in find_bank_files(data_dir):
+        try:
+            with open(path, "r", encoding='utf-8') as file:
+                bank = json.load(file)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Банк {path} пропущен: {e}", file=sys.stderr)
+            continue
+        for question in bank:
+            index[get_question_hash(question)] = question
+    return index
+
+
+def iter_question_scores(data_dir):
+    """(user_id, тема, ID вопроса, [оценки]) по одному вопросу пользователя"""
+    path = os.path.join(data_dir, USER_QUESTION_STATS_FILE)
+    if not os.path.exists(path):
+        return
+    for user_id, topics in iter_json_items(path):
+        for topic_key, questions in topics.items():
+            for question_id, scores in questions.items():
+                if scores:
+                    yield user_id, topic_key, question_id, scores
+
+# ======================== ОТЧЁТЫ ========================
+# Отчёт — (колонки, строки); колонка — (имя, тип: str, int или float)
+
+def report_scores(args, index):
+    columns = [("user_id", "str"), ("topic", "str"), ("question_id", "str"), ("question", "str"),
+               ("attempts", "int"), ("last_score", "int"), ("avg_score", "float")]
+    rows = (
+        (user_id, topic_key, question_id, index.get(question_id, ""),
+         len(scores), scores[-1], round(sum(scores) / len(scores), 1))
+        for user_id, topic_key, question_id, scores in iter_question_scores(args.data_dir)
+    )
+    return columns, rows
+
+
+def report_users(args, index):
+    columns = [("user_id", "str"), ("username", "str"), ("text_requests", "int"),
+               ("voice_requests", "int"), ("exam_answered", "int")]
+    rows = (
+        (user_id, record.username or "", record.text_requests,
+         record.voice_requests, record.exam_answered)
+        for user_id, record in iter_stats(os.path.join(args.data_dir, USER_STATS_FILE),
+                                          os.path.join(args.data_dir, LEGACY_USER_STATS_FILE))
+    )
+    return columns, rows
+
+
+def report_topics(args, index):
+    """Средний балл темы — среднее по студентам их среднего по вопросам, как в /progress"""
+    topics = {}  # тема -> [студентов, сумма средних студентов, оценок, {ID вопросов}]
+    current_user, user_topics = None, {}  # Суммы текущего пользователя: тема -> [сумма средних, вопросов]
+
+    def flush_user():
+        for topic_key, (score_sum, seen) in user_topics.items():
+            entry = topics.setdefault(topic_key, [0, 0.0, 0, set()])
+            entry[0] += 1
+            entry[1] += score_sum / seen
+        user_topics.clear()
+
+    for user_id, topic_key, question_id, scores in iter_question_scores(args.data_dir):
+        if user_id != current_user:
+            flush_user()
+            current_user = user_id
+        user_entry = user_topics.setdefault(topic_key, [0.0, 0])
+        user_entry[0] += sum(scores) / len(scores)
+        user_entry[1] += 1
+        entry = topics.setdefault(topic_key, [0, 0.0, 0, set()])
+        entry[2] += len(scores)
+        entry[3].add(question_id)
+    flush_user()
+
+    columns = [("topic", "str"), ("students", "int"), ("questions", "int"),
+               ("attempts", "int"), ("avg_score", "float")]
+    rows = [
+        (topic_key, students, len(question_ids), attempts,
+         round(score_sum / students, 1) if students else 0.0)
+        for topic_key, (students, score_sum, attempts, question_ids) in sorted(topics.items())
+    ]
+    return columns, rows
+
+
+def report_hardest(args, index):
+    """Вопросы с самым низким средним баллом студентов (среднее их средних)"""
+    questions = {}  # (тема, ID) -> [сумма средних, студентов]
+    for _, topic_key, question_id, scores in iter_question_scores(args.data_dir):
+        entry = questions.setdefault((topic_key, question_id), [0.0, 0])
+        entry[0] += sum(scores) / len(scores)
+        entry[1] += 1
+
+    hardest = heapq.nsmallest(
+        args.limit,
+        ((score_sum / students, students, key) for key, (score_sum, students) in questions.items()
+         if students >= args.min_students),
+    )
+    columns = [("topic", "str"), ("question_id", "str"), ("question", "str"),
+               ("students", "int"), ("avg_score", "float")]
+    rows = [
+        (topic_key, question_id, index.get(question_id, ""), students, round(avg_score, 1))
+        for avg_score, students, (topic_key, question_id) in hardest
+    ]
+    return columns, rows
+
+
+REPORTS = {
+    "scores": report_scores,
+    "users": report_users,
+    "topics": report_topics,
+    "hardest": report_hardest,
+}
+STREAMING_REPORTS = {"scores", "users"}  # Строки не собираются в память — только csv или parquet
+
+# ======================== ВЫВОД ========================
+
+def write_csv(columns, rows, out):
+    writer = csv.writer(out)
+    writer.writerow(name for name, _ in columns)
+    writer.writerows(rows)
+
+
+def write_table(columns, rows, out, max_width=60):
+    """Таблица для терминала; длинные тексты обрезаются"""
+    def cell(value):
+        text = str(value).replace("\n", " ")
+        return text if len(text) <= max_width else text[:max_width - 1] + "…"
+
+    header = [name for name, _ in columns]
+    cells = [[cell(value) for value in row] for row in rows]
+    widths = [max([len(name)] + [len(row[i]) for row in cells]) for i, name in enumerate(header)]
+    numeric = [kind != "str" for _, kind in columns]
+
+    def line(values):
+        return "  ".join(value.rjust(width) if is_numeric else value.ljust(width)
+                         for value, width, is_numeric in zip(values, widths, numeric)).rstrip()
+
+    out.write(line(header) + "\n")
+    out.write("  ".join("-" * width for width in widths) + "\n")
+    for row in cells:
+        out.write(line(row) + "\n")
+
+
+def write_parquet(columns, rows, path):
+    """Колоночный Parquet группами по PARQUET_BATCH_ROWS строк"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        sys.exit("❌ Для --format parquet нужен pyarrow: pip install pyarrow")
+
+    types = {"str": pa.string(), "int": pa.int64(), "float": pa.float64()}
+    schema = pa.schema([(name, types[kind]) for name, kind in columns])
+    rows = iter(rows)
+    with pq.ParquetWriter(path, schema) as writer:
+        while True:
+            batch = list(itertools.islice(rows, PARQUET_BATCH_ROWS))
+            if not batch:
+                break
+            writer.write_table(pa.Table.from_pylist(
+                [dict(zip(schema.names, row)) for row in batch], schema=schema))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Отчёты и выгрузка статистики студентов")
+    parser.add_argument("report", choices=sorted(REPORTS), help="какой отчёт построить")
+    parser.add_argument("--data-dir", default=".", help="рабочая директория бота (файлы состояния и theory/)")
+    parser.add_argument("--format", choices=["csv", "table", "parquet"],
+                        help="формат вывода; по умолчанию csv для выгрузок и table для сводок")
+    parser.add_argument("-o", "--output", help="файл вывода; по умолчанию stdout")
+    parser.add_argument("--limit", type=int, default=10, help="hardest: сколько вопросов показать")
+    parser.add_argument("--min-students", type=int, default=2,
+                        help="hardest: минимум студентов, ответивших на вопрос")
+    args = parser.parse_args()
+
+    if args.format is None:
+        args.format = "csv" if args.report in STREAMING_REPORTS else "table"
+    if args.format == "table" and args.report in STREAMING_REPORTS:
+        parser.error(f"{args.report}: таблица собирает все строки в памяти, используйте csv или parquet")
+    if args.format == "parquet" and not args.output:
+        parser.error("для parquet нужен --output")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    index = load_question_index(args.data_dir) if args.report in ("scores", "hardest") else {}
+    columns, rows = REPORTS[args.report](args, index)
+
+    if args.format == "parquet":
+        write_parquet(columns, rows, args.output)
+    else:
+        out = open(args.output, "w", encoding='utf-8', newline="") if args.output else sys.stdout
+        try:
+            (write_csv if args.format == "csv" else write_table)(columns, rows, out)
+        except BrokenPipeError:
+            # Вывод оборвали (например, | head) — остаток молча отбрасываем
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        finally:
+            if out is not sys.stdout:
+                out.close()
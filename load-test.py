@@ -0,0 +1,684 @@
+"""
+Нагрузочный тест бота: имитирует поток студентов на экзаменационной неделе.
+
+Каждый виртуальный студент проходит реальный сценарий:
+/exam → выбор темы → ответы (текст и голос) → теория → следующий вопрос → завершение
+либо /ticket → выбор темы → ответы на все вопросы билета → общая проверка → завершение.
+Обработчики бота настоящие, Telegram заменён локальным HTTP-сервером, Groq — заглушкой
+с настраиваемой задержкой.
+
+Пример:
+    python load-test.py --students 500 --rate 20 --time-scale 0.05
+    python load-test.py --rates 5,10,20,40 --students 300   # поиск точки насыщения
+"""
+import argparse
+import importlib.util
+import json
+import math
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BOT_FILE = os.path.join(BASE_DIR, "bot-exam.py")
+FAKE_TOKEN = "123456:LOADTEST"
+USER_ID_BASE = 10_000_000
+
+# ======================== TELEGRAM-ЗАГЛУШКА ========================
+
+class TelegramStandIn:
+    """Локальный сервер, отвечающий на вызовы Bot API и записывающий исходящие сообщения"""
+
+    def __init__(self):
+        self.lock = threading.Condition()
+        self.events = {}          # chat_id -> [(время, метод, текст)]
+        self.message_id = 1_000_000
+        self.calls = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._make_handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def events_count(self, chat_id):
+        with self.lock:
+            return len(self.events.get(chat_id, []))
+
+    def wait_for(self, chat_id, start_index, predicate, timeout):
+        """Ждёт событие в чате после start_index, удовлетворяющее предикату"""
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            while True:
+                chat_events = self.events.get(chat_id, [])
+                for event in chat_events[start_index:]:
+                    if predicate(event):
+                        return event
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.lock.wait(remaining)
+
+    def _record(self, method, params):
+        chat_id = int(params.get("chat_id", 0) or 0)
+        text = params.get("text", "")
+        with self.lock:
+            self.calls += 1
+            self.message_id += 1
+            message_id = self.message_id
+            if chat_id:
+                self.events.setdefault(chat_id, []).append((time.monotonic(), method, text))
+                self.lock.notify_all()
+        return chat_id, text, message_id
+
+    def _make_handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _params(self):
+                params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+                length = int(self.headers.get("Content-Length", 0) or 0)
+                if length:
+                    body = self.rfile.read(length)
+                    content_type = self.headers.get("Content-Type", "")
+                    if "json" in content_type:
+                        params.update(json.loads(body))
+                    elif "x-www-form-urlencoded" in content_type:
+                        params.update({k: v[0] for k, v in parse_qs(body.decode()).items()})
+                return params
+
+            def _reply(self, payload, content_type="application/json"):
+                body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._dispatch()
+
+            def do_POST(self):
+                self._dispatch()
+
+            def _dispatch(self):
+                path = urlparse(self.path).path
+                if path.startswith("/file/"):
+                    # Содержимое голосового файла — транскрибирует заглушка Groq
+                    self._reply(b"OggS" + b"\0" * 2048, "application/octet-stream")
+                    return
+
+                method = path.rsplit("/", 1)[-1]
+                params = self._params()
+                chat_id, text, message_id = stand_in._record(method, params)
+
+                if method in ("sendMessage", "editMessageText"):
+                    result = {
+                        "message_id": int(params.get("message_id", message_id)),
+                        "date": int(time.time()),
+                        "chat": {"id": chat_id, "type": "private"},
+                        "text": text,
+                    }
+                elif method == "getFile":
+                    file_id = params.get("file_id", "voice")
+                    result = {
+                        "file_id": file_id,
+                        "file_unique_id": file_id,
+                        "file_size": 2052,
+                        "file_path": f"voice/{file_id}.ogg",
+                    }
+                else:
+                    result = True
+                self._reply({"ok": True, "result": result})
+
+        return Handler
+
+
+# ======================== GROQ-ЗАГЛУШКА ========================
+
+class StubGroq:
+    """Заглушка клиента Groq с логнормальной задержкой ответа"""
+
+    def __init__(self, big_latency, small_latency, whisper_latency, jitter=0.35, drift=0.05):
+        self.drift = drift  # Доля оценок, где модель «забывает» JSON-схему
+        self.big_latency = big_latency
+        self.small_latency = small_latency
+        self.whisper_latency = whisper_latency
+        self.jitter = jitter
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.cached_prefixes = set()  # Системные промпты, уже побывавшие в «кэше префикса»
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self._chat))
+        self.audio = types.SimpleNamespace(transcriptions=types.SimpleNamespace(create=self._transcribe))
+
+    def _sleep(self, median):
+        if median > 0:
+            time.sleep(median * math.exp(random.gauss(0, self.jitter)))
+
+    def _count(self, kind):
+        with self.lock:
+            self.calls[kind] = self.calls.get(kind, 0) + 1
+
+    def _chat(self, messages, model, **kwargs):
+        prompt = "\n".join(message["content"] for message in messages)
+        numbers = re.findall(r"### Вопрос (\d+)", prompt)
+        if "ОТВЕТ ДЛЯ ИСПРАВЛЕНИЯ" in prompt:
+            kind = "grade_repair"
+            content = json.dumps(self._grade())
+        elif "КРИТЕРИИ ОЦЕНКИ" in prompt and numbers:
+            kind = "grade_batch"
+            results = []
+            for number in numbers:
+                grade = self._grade()
+                if random.random() < self.drift:
+                    grade["score"] = "хорошо"  # Не проходит схему — вопрос уйдёт на отдельную оценку
+                results.append({"number": int(number), **grade})
+            content = json.dumps({"results": results}, ensure_ascii=False)
+        elif "КРИТЕРИИ ОЦЕНКИ" in prompt:
+            kind = "grade"
+            if random.random() < self.drift:
+                content = f"Оценка: {random.randint(0, 100)}%\nРекомендация: раскройте определения."
+            else:
+                content = json.dumps(self._grade(), ensure_ascii=False)
+        elif "ИСПРАВЛЕННЫЙ ТЕКСТ" in prompt:
+            kind = "correct"
+            content = "Ответ студента после исправления распознавания."
+        elif "Вопрос:" in prompt:
+            kind = "theory"
+            content = "Теория по теме\n\n" + "Ключевые понятия и примеры. " * 40
+        else:
+            kind = "chat"
+            content = "Ответ ассистента."
+        self._count(kind)
+        self._sleep(self.big_latency if model.startswith("openai/") else self.small_latency)
+        if kwargs.get("response_format", {}).get("type") == "json_object":
+            try:
+                json.loads(content)
+            except ValueError:
+                raise self._json_validate_failed(content)
+        message = types.SimpleNamespace(content=content)
+        # Как у провайдера: повторяющийся системный префикс засчитывается как кэшированный
+        prefix = messages[0]["content"] if messages[0]["role"] == "system" else ""
+        with self.lock:
+            cached = len(prefix) // 3 if prefix in self.cached_prefixes else 0
+            self.cached_prefixes.add(prefix)
+        usage = types.SimpleNamespace(
+            prompt_tokens=len(prompt) // 3, completion_tokens=len(content) // 3,
+            prompt_tokens_details=types.SimpleNamespace(cached_tokens=cached))
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=usage)
+
+    @staticmethod
+    def _json_validate_failed(content):
+        """Как у провайдера: невалидный JSON в JSON-режиме — 400, текст ответа в failed_generation"""
+        import groq
+        import httpx
+        request = httpx.Request("POST", "https://api.groq.com/openai/v1/chat/completions")
+        body = {"error": {"message": "Failed to generate JSON.", "type": "invalid_request_error",
+                          "code": "json_validate_failed", "failed_generation": content}}
+        return groq.BadRequestError("Error code: 400", response=httpx.Response(400, request=request),
+                                    body=body)
+
+    @staticmethod
+    def _grade():
+        return {"score": random.randint(0, 100),
+                "missing": ["раскройте ключевые определения"],
+                "strengths": ["верно названа тема"]}
+
+    def _transcribe(self, model, file, language=None, **kwargs):
+        self._count("whisper")
+        self._sleep(self.whisper_latency)
+        return types.SimpleNamespace(text="Я думаю, что ответ связан с основными определениями темы.")
+
+
+# ======================== ЗАГРУЗКА БОТА ========================
+
+def load_bot_module(workdir, api_url, num_threads):
+    """Импортирует bot-exam.py с поддельным config и перенаправленным Bot API"""
+    sys.modules["config"] = types.SimpleNamespace(TOKEN_TG=FAKE_TOKEN, TOKEN_AI="stub")
+
+    import telebot
+    from telebot import apihelper
+    apihelper.API_URL = api_url + "/bot{0}/{1}"
+    apihelper.FILE_URL = api_url + "/file/bot{0}/{1}"
+
+    # Копия банков: индексы сложности пишутся рядом с ними и не должны попасть в репозиторий
+    shutil.copytree(os.path.join(BASE_DIR, "theory"), os.path.join(workdir, "theory"),
+                    ignore=shutil.ignore_patterns("*.difficulty.json"))
+    os.chdir(workdir)
+
+    spec = importlib.util.spec_from_file_location("bot_exam_loadtest", BOT_FILE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    # Пересоздаём бота с нужным размером пула, сохраняя обработчики и middleware
+    handlers = module.bot.message_handlers
+    middlewares = module.bot.middlewares
+    module.bot.worker_pool.close()
+    module.bot = telebot.TeleBot(FAKE_TOKEN, num_threads=num_threads, use_class_middlewares=True)
+    module.bot.message_handlers = handlers
+    module.bot.middlewares = middlewares
+    module.load_all_data()
+    return module
+
+
+class HandlerTimer:
+    """
+    Оборачивает обработчики бота: фиксирует момент начала обработки апдейта и
+    исключения (пул telebot пишет их только в debug-лог)
+    """
+
+    def __init__(self, bot):
+        self.lock = threading.Lock()
+        self.started = {}
+        self.exceptions = {}  # "Тип: текст" -> количество
+        for handler in bot.message_handlers:
+            handler["function"] = self._wrap(handler["function"])
+
+    def _wrap(self, func):
+        def wrapper(message):
+            with self.lock:
+                self.started[(message.chat.id, message.message_id)] = time.monotonic()
+            try:
+                return func(message)
+            except Exception as e:
+                key = f"{type(e).__name__}: {e}"[:200]
+                with self.lock:
+                    self.exceptions[key] = self.exceptions.get(key, 0) + 1
+                raise
+        wrapper.__name__ = func.__name__
+        return wrapper
+
+    def started_at(self, chat_id, message_id):
+        with self.lock:
+            return self.started.get((chat_id, message_id))
+
+
+# ======================== СТУДЕНТ ========================
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    low, high = math.floor(k), math.ceil(k)
+    return values[low] + (values[high] - values[low]) * (k - low)
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = {}       # шаг -> [сек]
+        self.queueing = []      # задержка до начала обработки
+        self.errors = {}        # шаг -> количество ответов "❌"
+        self.timeouts = {}      # шаг -> количество таймаутов
+        self.sessions_done = 0
+        self.answers = {}       # user_id -> отправлено ответов
+
+    def add(self, step, latency, queueing, error):
+        with self.lock:
+            self.latency.setdefault(step, []).append(latency)
+            if queueing is not None:
+                self.queueing.append(queueing)
+            if error:
+                self.errors[step] = self.errors.get(step, 0) + 1
+
+    def timeout(self, step):
+        with self.lock:
+            self.timeouts[step] = self.timeouts.get(step, 0) + 1
+
+
+class Student:
+    """Виртуальный студент, проходящий экзамен через реальные обработчики"""
+
+    def __init__(self, index, ctx):
+        self.ctx = ctx
+        self.user_id = USER_ID_BASE + index
+        self.username = f"student{index}"
+        self.rng = random.Random(ctx.args.seed * 100_003 + index)
+        self.answers_sent = 0
+        self.finished = False
+
+    def think(self, median):
+        time.sleep(median * self.rng.lognormvariate(0, 0.5) * self.ctx.args.time_scale)
+
+    def _message(self, **payload):
+        ctx = self.ctx
+        with ctx.lock:
+            ctx.update_id += 1
+            ctx.message_id += 1
+            update_id, message_id = ctx.update_id, ctx.message_id
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": self.user_id, "type": "private"},
+            "from": {"id": self.user_id, "is_bot": False,
+                     "first_name": "Студент", "username": self.username},
+        }
+        message.update(payload)
+        return update_id, message
+
+    def send(self, step, expect, timeout=None, **payload):
+        """Отправляет апдейт и ждёт ответ бота; возвращает текст ответа или None"""
+        from telebot.types import Update
+        ctx = self.ctx
+        update_id, message = self._message(**payload)
+        start_index = ctx.telegram.events_count(self.user_id)
+        sent_at = time.monotonic()
+        update = Update.de_json({"update_id": update_id, "message": message})
+        ctx.bot_module.bot.process_new_updates([update])
+        if self.rng.random() < ctx.args.dup_share:
+            # Повторная доставка того же апдейта, как после переподключения поллинга
+            ctx.bot_module.bot.process_new_updates([update])
+            with ctx.lock:
+                ctx.duplicates_sent += 1
+
+        def predicate(event):
+            _, method, text = event
+            return text.startswith("❌") or any(
+                method == m and text.startswith(prefix) for m, prefix in expect)
+
+        event = ctx.telegram.wait_for(self.user_id, start_index, predicate,
+                                      timeout or ctx.args.step_timeout)
+        if event is None:
+            ctx.metrics.timeout(step)
+            return None
+
+        started = ctx.timer.started_at(self.user_id, message["message_id"])
+        queueing = started - sent_at if started is not None else None
+        ctx.metrics.add(step, event[0] - sent_at, queueing, event[2].startswith("❌"))
+        return event[2]
+
+    def send_text(self, step, text, expect):
+        payload = {"text": text}
+        if text.startswith("/"):
+            payload["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+        return self.send(step, expect, **payload)
+
+    def send_voice(self, step, expect):
+        file_id = f"v{self.user_id}_{self.answers_sent}"
+        voice = {"file_id": file_id, "file_unique_id": file_id, "duration": 20, "file_size": 2052}
+        return self.send(step, expect, voice=voice)
+
+    def answer(self, expect=(("sendMessage", "📝 Результат"),)):
+        """Отправляет ответ; возвращает текст ответа бота или None"""
+        args = self.ctx.args
+        self.think(args.answer_think)
+        if self.rng.random() < args.voice_share:
+            reply = self.send_voice("answer_voice", expect)
+        else:
+            reply = self.send_text("answer_text", "Мой ответ: " + "определение и пример. " * 8, expect)
+        if reply is not None:
+            self.answers_sent += 1
+        return reply
+
+    def run(self):
+        if self.rng.random() < self.ctx.args.ticket_share:
+            self.run_ticket()
+        else:
+            self.run_exam()
+
+    def finish(self):
+        self.think(self.ctx.args.menu_think)
+        if self.send_text("end", "❌ Завершить экзамен", [("sendMessage", "✅ Экзамен завершён")]) is None:
+            return
+        self.finished = True
+        with self.ctx.metrics.lock:
+            self.ctx.metrics.sessions_done += 1
+
+    def run_ticket(self):
+        """Билет: ответы на все вопросы подряд, одна общая проверка"""
+        args = self.ctx.args
+        if self.send_text("ticket", "/ticket", [("sendMessage", "🎯 Выберите тему")]) is None:
+            return
+        self.think(args.menu_think)
+        if self.send_text("topic", self.rng.choice(self.ctx.topics), [("sendMessage", "🎫 Билет начат")]) is None:
+            return
+        expect = (("sendMessage", "📋 Вопрос"), ("sendMessage", "📝 Результат билета"))
+        while True:
+            reply = self.answer(expect)
+            if reply is None or reply.startswith("❌"):
+                return
+            if reply.startswith("📝"):
+                break
+        self.finish()
+
+    def run_exam(self):
+        args = self.ctx.args
+        topics = self.ctx.topics
+
+        if self.send_text("exam", "/exam", [("sendMessage", "🎯 Выберите тему")]) is None:
+            return
+        self.think(args.menu_think)
+        topic = self.rng.choice(topics)
+        if self.send_text("topic", topic, [("sendMessage", "🎯 Экзамен начат")]) is None:
+            return
+        if not self.answer():
+            return
+
+        questions = max(1, int(self.rng.expovariate(1 / args.questions)) + 1)
+        for _ in range(questions - 1):
+            if self.rng.random() < args.theory_share:
+                self.think(args.menu_think)
+                style = self.rng.choice(["📚 Теория (классика)", "🔥 Теория (зумеры)"])
+                if self.send_text("theory", style, [("editMessageText", "")]) is None:
+                    return
+                self.think(args.read_think)
+            self.think(args.menu_think)
+            if self.send_text("next", "⏭️ Следующий вопрос", [("sendMessage", "📋 Следующий вопрос")]) is None:
+                return
+            if not self.answer():
+                return
+
+        self.finish()
+
+
+# ======================== ПРОВЕРКА СОСТОЯНИЯ ========================
+
+def read_json_strict(filename):
+    with open(filename, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def read_sessions_strict(filename):
+    import storage
+    return storage.load_sessions(filename)
+
+
+def read_stats_strict(filename):
+    import storage
+    return storage.load_stats(filename)
+
+
+def check_consistency(ctx, students):
+    """Сверяет итоговое состояние на диске с тем, что сделали студенты"""
+    module = ctx.bot_module
+    problems = []
+    on_disk = {}
+    readers = {
+        "USER_STATS_FILE": read_stats_strict,
+        "EXAM_STATE_FILE": read_sessions_strict,
+        "USER_QUESTION_STATS_FILE": read_json_strict,
+    }
+    for name, reader in readers.items():
+        filename = getattr(module, name)
+        try:
+            on_disk[name] = reader(filename)
+        except Exception as e:
+            problems.append(f"{filename}: файл повреждён ({e})")
+            on_disk[name] = {}
+
+    stats = on_disk["USER_STATS_FILE"]
+    states = on_disk["EXAM_STATE_FILE"]
+    question_stats = on_disk["USER_QUESTION_STATS_FILE"]
+
+    for student in students:
+        uid = str(student.user_id)
+        answered = stats[uid].exam_answered if uid in stats else 0
+        if answered != student.answers_sent:
+            problems.append(f"{uid}: exam_answered={answered}, отправлено {student.answers_sent}")
+        scores = sum(len(v) for topic in question_stats.get(uid, {}).values() for v in topic.values())
+        if scores > student.answers_sent:
+            problems.append(f"{uid}: оценок {scores} больше, чем ответов {student.answers_sent}")
+        if student.finished and uid in states:
+            problems.append(f"{uid}: экзамен завершён, но состояние осталось на диске")
+
+    if stats != module.user_stats:
+        problems.append("user_stats на диске расходится с памятью")
+    if question_stats != module.user_question_stats:
+        problems.append("user_question_stats на диске расходится с памятью")
+    problems.extend(check_mastery(module))
+    dropped = ctx.bot_module.coalesce_metrics["duplicates"]
+    if dropped != ctx.duplicates_sent:
+        problems.append(f"повторных апдейтов отправлено {ctx.duplicates_sent}, отброшено {dropped}")
+    return problems
+
+
+def check_mastery(module):
+    """
+    Инкрементальные агрегаты освоения студентов прогона должны совпадать с
+    пересчётом с нуля (сам update на случайных данных проверяет python storage.py)
+    """
+    from storage import mastery_matches
+    problems = []
+    for uid, topics in module.user_question_stats.items():
+        for topic_key, topic_scores in topics.items():
+            mastery = module.user_topic_mastery.get(uid, {}).get(topic_key)
+            if not mastery_matches(mastery, module.TopicMastery.from_scores(topic_scores)):
+                problems.append(f"{uid}/{topic_key}: агрегат освоения расходится с пересчётом")
+    return problems
+
+
+# ======================== ЗАПУСК ========================
+
+def run_once(args, rate):
+    workdir = tempfile.mkdtemp(prefix="exam-load-")
+    cwd = os.getcwd()
+    telegram = TelegramStandIn()
+    telegram.start()
+    try:
+        ctx = types.SimpleNamespace(
+            args=args, lock=threading.Lock(), update_id=0, message_id=0, duplicates_sent=0,
+            telegram=telegram, metrics=Metrics(),
+        )
+        ctx.bot_module = load_bot_module(workdir, telegram.url, args.workers)
+        ctx.bot_module.client = StubGroq(args.llm_latency, args.small_latency, args.whisper_latency)
+        ctx.timer = HandlerTimer(ctx.bot_module.bot)
+        ctx.topics = [data["display_name"] for key, data in ctx.bot_module.EXAM_TOPICS.items()
+                      if ctx.bot_module.load_topic_data(key)]
+
+        students = [Student(i, ctx) for i in range(args.students)]
+        threads = []
+        arrivals = random.Random(args.seed)
+        started = time.monotonic()
+        for student in students:
+            thread = threading.Thread(target=student.run, daemon=True)
+            thread.start()
+            threads.append(thread)
+            time.sleep(arrivals.expovariate(rate))
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        # Дожидаемся, пока пул бота допишет хвосты
+        while ctx.bot_module.bot.worker_pool.tasks.qsize():
+            time.sleep(0.05)
+        time.sleep(0.2)
+
+        problems = check_consistency(ctx, students)
+        report(ctx, rate, elapsed, telegram, problems)
+        ctx.bot_module.bot.worker_pool.close()
+        return ctx, elapsed, problems
+    finally:
+        telegram.stop()
+        os.chdir(cwd)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+        else:
+            print(f"📁 Файлы состояния: {workdir}")
+
+
+def report(ctx, rate, elapsed, telegram, problems):
+    m = ctx.metrics
+    steps = sum(len(v) for v in m.latency.values())
+    print(f"\n📈 Интенсивность: {rate:g} студ/с, студентов: {ctx.args.students}, "
+          f"воркеров бота: {ctx.args.workers}, время: {elapsed:.1f} с")
+    print(f"   Завершено сессий: {m.sessions_done}, шагов: {steps} "
+          f"({steps / elapsed:.1f} шаг/с), вызовов Bot API: {telegram.calls}")
+    print(f"   Вызовы LLM: {ctx.bot_module.client.calls}")
+    print("   " + ctx.bot_module.format_coalesce_metrics().replace("\n\n", " ").replace("\n", " | ")
+          + f" (повторов отправлено: {ctx.duplicates_sent})")
+    print("   " + ctx.bot_module.format_grading_metrics().replace("\n\n", " ").replace("\n", " | "))
+    print("   " + ctx.bot_module.format_prefetch_metrics().replace("\n\n", " ").replace("\n", " | "))
+    print("   " + ctx.bot_module.format_usage().replace("\n\n", "\n").replace("\n", "\n   "))
+    print(f"   Ожидание в очереди: p50={percentile(m.queueing, 50) * 1000:.0f} мс  "
+          f"p95={percentile(m.queueing, 95) * 1000:.0f} мс  "
+          f"p99={percentile(m.queueing, 99) * 1000:.0f} мс  "
+          f"max={max(m.queueing, default=0) * 1000:.0f} мс")
+    print(f"   {'шаг':<14}{'n':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}{'ошибок':>8}{'таймаут':>9}")
+    for step in sorted(set(m.latency) | set(m.timeouts)):
+        values = m.latency.get(step, [])
+        print(f"   {step:<14}{len(values):>7}"
+              f"{percentile(values, 50):>8.2f}s{percentile(values, 95):>8.2f}s"
+              f"{percentile(values, 99):>8.2f}s{max(values, default=0):>8.2f}s"
+              f"{m.errors.get(step, 0):>8}{m.timeouts.get(step, 0):>9}")
+    if ctx.timer.exceptions:
+        print(f"   ❌ Исключения в обработчиках: {sum(ctx.timer.exceptions.values())}")
+        for error, count in ctx.timer.exceptions.items():
+            print(f"      • {count} × {error}")
+    if problems:
+        print(f"   ❌ Несогласованность состояния: {len(problems)}")
+        for problem in problems[:10]:
+            print(f"      • {problem}")
+    else:
+        print("   ✅ Состояние на диске согласовано")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест экзаменационного бота")
+    parser.add_argument("--students", type=int, default=200, help="число виртуальных студентов")
+    parser.add_argument("--rate", type=float, default=10.0, help="интенсивность прихода, студентов/с")
+    parser.add_argument("--rates", type=str, default="", help="список интенсивностей через запятую")
+    parser.add_argument("--workers", type=int, default=2, help="потоков обработки в боте")
+    parser.add_argument("--questions", type=float, default=3.0, help="среднее число вопросов за сессию")
+    parser.add_argument("--voice-share", type=float, default=0.3, help="доля голосовых ответов")
+    parser.add_argument("--ticket-share", type=float, default=0.2, help="доля студентов в режиме билета")
+    parser.add_argument("--dup-share", type=float, default=0.05, help="доля апдейтов, доставленных дважды")
+    parser.add_argument("--theory-share", type=float, default=0.4, help="доля вопросов с запросом теории")
+    parser.add_argument("--answer-think", type=float, default=60.0, help="медианное время на ответ, с")
+    parser.add_argument("--read-think", type=float, default=40.0, help="медианное время чтения теории, с")
+    parser.add_argument("--menu-think", type=float, default=3.0, help="медианное время нажатия кнопки, с")
+    parser.add_argument("--time-scale", type=float, default=0.02, help="множитель времени на раздумья")
+    parser.add_argument("--llm-latency", type=float, default=2.0, help="медианная задержка большой модели, с")
+    parser.add_argument("--small-latency", type=float, default=0.5, help="медианная задержка малой модели, с")
+    parser.add_argument("--whisper-latency", type=float, default=0.8, help="медианная задержка whisper, с")
+    parser.add_argument("--step-timeout", type=float, default=120.0, help="таймаут ожидания ответа бота, с")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--keep", action="store_true", help="не удалять рабочую директорию")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    rates = [float(r) for r in args.rates.split(",") if r] or [args.rate]
+    for rate in rates:
+        run_once(args, rate)
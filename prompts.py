@@ -0,0 +1,210 @@
+"""
+Реестр шаблонов промптов.
+
+Каждый шаблон делится на две части:
+
+    static   — инструкции, рубрика и схема ответа; уходит первым (system)
+    variable — вопрос, эталон, ответ студента; уходит последним (user)
+
+Одинаковое начало запросов провайдер может взять из кэша префикса и не
+считать заново, поэтому в static нельзя подставлять данные запроса.
+
+Шаблоны версионируются и могут переопределяться для отдельной темы:
+get_template(task, topic_key) берёт шаблон темы, если он зарегистрирован,
+иначе общий. Ключ шаблона (задача, тема, версия, отпечаток текста) входит в
+ключи кэшей ответов, а расход токенов считается по каждому шаблону отдельно.
+"""
+import hashlib
+import threading
+
+GRADING_CRITERIA = """КРИТЕРИИ ОЦЕНКИ:
+0-15%: Полностью неверный ответ – не относится к вопросу, только тема без объяснений, бессмысленный набор слов.
+16-35%: Минимальное понимание – упоминается тема, но нет объяснений, 1-2 правильных факта.
+36-55%: Частичное понимание – основная идея есть, детали неточные, 30-50% ключевых моментов, несколько ошибок.
+56-75%: Хорошее понимание – большинство ключевых моментов раскрыты, логичная структура, минимум ошибок.
+76-90%: Отличное понимание – тема раскрыта полностью, основные и дополнительные детали, четкая логика.
+91-100%: Превосходное знание – исчерпывающий ответ, дополнительные примеры, глубокое понимание.
+
+ИСКЛЮЧЕНИЕ:
+- Когда эталон гласит что-то по типу "в источниках нет ответа / информации" или "ответ дать невозможно". В таком случае, оценивай насколько хорошо пользователь ответил на поставленный вопрос и игнорируй эталон.
+
+ВАЖНО:
+- Если эталон качественный, сверяй ответ с ним.
+- Не завышай оценку за общие фразы.
+- Учитывай полноту и точность.
+- Оцени в процентах (0-100)."""
+
+GRADE_SCHEMA = """
+{"score": <целое 0-100>, "missing": [<чего не хватает по сравнению с эталоном>], "strengths": [<что в ответе хорошо>]}
+В missing и strengths — не больше 3 пунктов, каждый — одно короткое предложение."""
+
+BATCH_GRADE_SCHEMA = """
+{"results": [{"number": <номер вопроса>, "score": <целое 0-100>, "missing": [<чего не хватает>], "strengths": [<что хорошо>]}]}
+По одному элементу на каждый вопрос. В missing и strengths — не больше 3 коротких пунктов."""
+
+# Блок одного вопроса в пакетной оценке билета
+BATCH_ITEM = """### Вопрос {number}
+ВОПРОС: {question}
+ПРАВИЛЬНЫЙ ОТВЕТ (эталон): {correct_answer}
+ОТВЕТ СТУДЕНТА: {user_answer}"""
+
+
+class PromptTemplate:
+    """Версионированный шаблон: статический префикс и формат переменной части"""
+    __slots__ = ("task", "topic_key", "version", "static", "variable", "key", "fingerprint")
+
+    def __init__(self, task, version, static, variable, topic_key=None):
+        self.task = task
+        self.topic_key = topic_key
+        self.version = version
+        self.static = static
+        self.variable = variable
+        self.key = f"{task}@{topic_key or '*'}/v{version}"
+        # Отпечаток текста: правка шаблона без смены версии тоже сбрасывает кэши
+        self.fingerprint = hashlib.md5(f"{static}\0{variable}".encode('utf-8')).hexdigest()[:8]
+
+    def messages(self, **fields):
+        """Сообщения для chat.completions: сначала статика, данные — в конце"""
+        return [
+            {"role": "system", "content": self.static},
+            {"role": "user", "content": self.variable.format(**fields)},
+        ]
+
+    def cache_key(self, *parts):
+        """Ключ кэша ответа: шаблон с версией + данные запроса"""
+        payload = "\0".join((self.key, self.fingerprint) + parts)
+        return hashlib.md5(payload.encode('utf-8')).hexdigest()
+
+    def __repr__(self):
+        return f"PromptTemplate({self.key}, {self.fingerprint})"
+
+
+_templates = {}  # (task, topic_key) -> PromptTemplate
+
+
+def register_template(task, version, static, variable, topic_key=None):
+    """Регистрирует шаблон; topic_key=None — общий шаблон задачи"""
+    template = PromptTemplate(task, version, static, variable, topic_key)
+    _templates[(task, topic_key)] = template
+    return template
+
+
+def get_template(task, topic_key=None):
+    """Шаблон задачи для темы, при отсутствии — общий"""
+    return _templates.get((task, topic_key)) or _templates[(task, None)]
+
+
+# ======================== УЧЁТ ТОКЕНОВ ========================
+
+class TemplateUsage:
+    """Расход токенов по одному шаблону"""
+    __slots__ = ("requests", "prompt_tokens", "cached_tokens", "completion_tokens")
+
+    def __init__(self):
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+
+
+template_usage = {}  # Ключ шаблона -> TemplateUsage
+_usage_lock = threading.Lock()
+
+
+def record_usage(template, usage):
+    """Учитывает usage ответа провайдера; cached_tokens — часть входа, взятая из кэша префикса"""
+    details = getattr(usage, "prompt_tokens_details", None)
+    with _usage_lock:
+        record = template_usage.setdefault(template.key, TemplateUsage())
+        record.requests += 1
+        record.prompt_tokens += getattr(usage, "prompt_tokens", 0) or 0
+        record.cached_tokens += getattr(details, "cached_tokens", 0) or 0
+        record.completion_tokens += getattr(usage, "completion_tokens", 0) or 0
+
+
+def format_usage():
+    """Сводка расхода токенов по шаблонам"""
+    with _usage_lock:
+        records = sorted(template_usage.items())
+        lines = []
+        for key, record in records:
+            cached_share = record.cached_tokens / record.prompt_tokens * 100 if record.prompt_tokens else 0
+            lines.append(f"• {key}: {record.requests} запр., вход {record.prompt_tokens} "
+                         f"(из кэша {cached_share:.0f}%), выход {record.completion_tokens}")
+    if not lines:
+        return "🧾 Токены по шаблонам: запросов ещё не было"
+    return "🧾 Токены по шаблонам:\n\n" + "\n".join(lines)
+
+
+# ======================== ШАБЛОНЫ ========================
+
+register_template(
+    "grade", 1,
+    f"""Ты — экзаменатор. Оцени ответ студента на вопрос, сверяя его с эталоном.
+
+{GRADING_CRITERIA}
+
+Отвечай ТОЛЬКО JSON-объектом по схеме:{GRADE_SCHEMA}""",
+    """ВОПРОС: {question}
+ПРАВИЛЬНЫЙ ОТВЕТ (эталон): {correct_answer}
+ОТВЕТ СТУДЕНТА: {user_answer}""",
+)
+
+register_template(
+    "grade_batch", 1,
+    f"""Ты — экзаменатор. Оцени ответы студента на вопросы билета, сверяя их с эталонами. Каждый вопрос оценивай независимо.
+
+{GRADING_CRITERIA}
+
+Отвечай ТОЛЬКО JSON-объектом по схеме:{BATCH_GRADE_SCHEMA}""",
+    """Вопросов в билете: {count}
+
+{items}""",
+)
+
+# Починка ответа, не прошедшего схему: по шаблону на каждую схему оценки
+for task, schema in (("grade", GRADE_SCHEMA), ("grade_batch", BATCH_GRADE_SCHEMA)):
+    register_template(
+        f"repair_{task}", 1,
+        f"""Приведи ответ к валидному JSON строго по схеме. Ничего не добавляй от себя, только перенеси данные.
+СХЕМА:{schema}""",
+        """ОТВЕТ ДЛЯ ИСПРАВЛЕНИЯ:
+{raw_response}""",
+    )
+
+register_template(
+    "theory_dry", 1,
+    """Дай точное объяснение по экзаменационному вопросу строго по шаблону из правильного ответа. Не использовать **жирный шрифт**.""",
+    """Вопрос: {question}
+Правильный ответ: {correct_answer}""",
+)
+
+register_template(
+    "theory_zoomers", 1,
+    """Ты — преподаватель информатики. На основе экзаменационного вопроса и эталонного ответа составь компактный, но полный конспект по теме для подготовки к экзамену. Излагай структурировано с подзаголовками, списками и короткими примерами кода, где уместно. Не использовать **жирный шрифт**.
+
+Требования к структуре:
+1) Краткое введение в тему (1–2 предложения)
+2) Ключевые понятия и определения
+3) Основные приёмы/синтаксис/формулы (по теме)
+4) Короткие примеры (минимум 2)
+5) Частые ошибки и как их избегать
+6) Мини-чеклист перед экзаменом
+
+Выводи строго на русском языке. Заголовок: 'Теория по теме'.""",
+    """Вопрос: {question}
+Эталонный ответ: {correct_answer}""",
+)
+
+register_template(
+    "correct_transcription", 1,
+    """Ты — эксперт по исправлению ошибок распознавания речи.
+ЗАДАЧА: Исправь ошибки в тексте, сохраняя смысл и стиль автора.
+
+ПРАВИЛА:
+1. Если сомневаешься — оставляй как есть
+2. Отвечай ТОЛЬКО исправленным текстом без комментариев""",
+    """ИСХОДНЫЙ ТЕКСТ: {text}
+
+ИСПРАВЛЕННЫЙ ТЕКСТ:""",
+)
@@ -0,0 +1,486 @@
+"""
+Компактное хранение состояний экзамена и статистики пользователей.
+
+Записи со __slots__ держат только ID вопроса и небольшие числа — текст вопроса
+и эталон берутся из банка темы. На диск пишется бинарный формат:
+
+    MAGIC (4 байта) | число записей (u32) | записи
+
+Старые JSON-файлы читаются загрузчиками и конвертируются на лету.
+Для офлайн-отчётов есть потоковые итераторы: они отдают записи по одной,
+не загружая файл целиком.
+
+Самопроверка без запуска бота: python storage.py
+"""
+import hashlib
+import io
+import json
+import os
+import random
+import struct
+import sys
+import threading
+
+PHASE_TOPIC = 1   # Ждём выбор темы
+PHASE_ANSWER = 2  # Ждём ответ на вопрос
+PHASE_ACTION = 3  # Ждём действие после ответа
+
+SESSIONS_MAGIC = b"EXS2"
+SESSIONS_MAGIC_V1 = b"EXS1"  # Без билетов, читается для совместимости
+STATS_MAGIC = b"UST1"
+
+_HEADER = struct.Struct("<4sI")
+# user_id, фаза, длина ключа темы, ID вопроса (6 байт), время начала
+_SESSION_V1 = struct.Struct("<QBB6sI")
+# ... + длина билета (NO_TICKET — обычный режим), число собранных ответов
+_SESSION = struct.Struct("<QBB6sIBB")
+# Длина одного ответа билета
+_ANSWER_LEN = struct.Struct("<H")
+NO_TICKET = 0xFF
+# user_id, текстовые, голосовые, экзаменационные ответы, длина username
+_STATS = struct.Struct("<QIIIB")
+
+_NO_QUESTION = b"\0" * 6
+
+# Сериализует кодирование и запись: последний закодированный снимок пишется последним
+_write_lock = threading.Lock()
+
+
+def get_question_hash(question_text):
+    """Создает уникальный хеш для вопроса"""
+    return hashlib.md5(question_text.encode('utf-8')).hexdigest()[:12]
+
+
+class ExamSession:
+    """
+    Состояние экзамена пользователя: только ID и небольшие числа.
+    В режиме билета ticket — список ID вопросов билета, answers — собранные ответы.
+    """
+    __slots__ = ("topic", "question_id", "phase", "start_time", "ticket", "answers")
+
+    def __init__(self, topic=None, question_id=None, phase=PHASE_TOPIC, start_time=0,
+                 ticket=None, answers=None):
+        self.topic = topic
+        self.question_id = question_id
+        self.phase = phase
+        self.start_time = start_time
+        self.ticket = ticket
+        self.answers = answers if answers is not None else []
+
+    @property
+    def waiting_topic(self):
+        return self.phase == PHASE_TOPIC
+
+    @property
+    def waiting_answer(self):
+        return self.phase == PHASE_ANSWER
+
+    @property
+    def waiting_action(self):
+        return self.phase == PHASE_ACTION
+
+    def __eq__(self, other):
+        return isinstance(other, ExamSession) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return (f"ExamSession(topic={self.topic!r}, question_id={self.question_id!r}, "
+                f"phase={self.phase}, start_time={self.start_time}, "
+                f"ticket={self.ticket!r}, answers={len(self.answers)})")
+
+
+class UserStats:
+    """Счётчики запросов пользователя"""
+    __slots__ = ("username", "text_requests", "voice_requests", "exam_answered")
+
+    def __init__(self, username=None, text_requests=0, voice_requests=0, exam_answered=0):
+        self.username = username
+        self.text_requests = text_requests
+        self.voice_requests = voice_requests
+        self.exam_answered = exam_answered
+
+    def __eq__(self, other):
+        return isinstance(other, UserStats) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return (f"UserStats(username={self.username!r}, text_requests={self.text_requests}, "
+                f"voice_requests={self.voice_requests}, exam_answered={self.exam_answered})")
+
+
+class TopicMastery:
+    """
+    Агрегат освоения темы пользователем, обновляется по одной оценке за раз.
+    score_sum — сумма средних баллов по вопросам, weakest — [(средний балл, ID)]
+    самых слабых вопросов по возрастанию.
+    """
+    __slots__ = ("seen", "score_sum", "weakest")
+
+    WEAKEST_N = 3
+
+    def __init__(self):
+        self.seen = 0
+        self.score_sum = 0.0
+        self.weakest = []
+
+    @property
+    def mean(self):
+        return self.score_sum / self.seen if self.seen else 0
+
+    def update(self, question_id, old_avg, new_avg, topic_scores):
+        """
+        Учитывает изменение среднего балла вопроса (old_avg=None — вопрос новый).
+        topic_scores ({ID: [оценки]}) перебирается, только если вопрос из weakest
+        поднялся выше границы и на его место нужен следующий по слабости.
+        """
+        if old_avg is None:
+            self.seen += 1
+            self.score_sum += new_avg
+        else:
+            self.score_sum += new_avg - old_avg
+
+        item = (new_avg, question_id)
+        was_weak = any(qid == question_id for _, qid in self.weakest)
+        if was_weak:
+            # Граница берётся до удаления: если вопрос из полного списка поднялся выше неё,
+            # его место может занять вопрос вне списка — такой известен только по topic_scores
+            if len(self.weakest) == self.WEAKEST_N and item > self.weakest[-1]:
+                self.rebuild_weakest(topic_scores)
+                return
+            self.weakest = [entry for entry in self.weakest if entry[1] != question_id]
+
+        if len(self.weakest) < self.WEAKEST_N or item < self.weakest[-1]:
+            self.weakest.append(item)
+            self.weakest.sort()
+            del self.weakest[self.WEAKEST_N:]
+
+    def rebuild_weakest(self, topic_scores):
+        averages = ((sum(scores) / len(scores), qid) for qid, scores in topic_scores.items() if scores)
+        self.weakest = sorted(averages)[:self.WEAKEST_N]
+
+    @classmethod
+    def from_scores(cls, topic_scores):
+        """Построение агрегата с нуля по {ID: [оценки]}"""
+        mastery = cls()
+        for scores in topic_scores.values():
+            if scores:
+                mastery.seen += 1
+                mastery.score_sum += sum(scores) / len(scores)
+        mastery.rebuild_weakest(topic_scores)
+        return mastery
+
+
+# ======================== ЗАПИСЬ ========================
+
+def write_atomic(filename, payload):
+    """Запись через временный файл: при падении на диске остаётся прошлая версия"""
+    tmp_filename = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_filename, "wb") as file:
+        file.write(payload)
+    os.replace(tmp_filename, filename)
+
+
+def encode_sessions(sessions):
+    # Число записей берётся из того же снимка, что и сами записи:
+    # словарь параллельно меняют другие потоки
+    items = list(sessions.items())
+    parts = [_HEADER.pack(SESSIONS_MAGIC, len(items))]
+    for user_id, session in items:
+        topic = (session.topic or "").encode('utf-8')
+        question_id = bytes.fromhex(session.question_id) if session.question_id else _NO_QUESTION
+        ticket = session.ticket
+        answers = [answer.encode('utf-8')[:0xFFFF] for answer in session.answers]
+        parts.append(_SESSION.pack(int(user_id), session.phase, len(topic),
+                                   question_id, int(session.start_time),
+                                   NO_TICKET if ticket is None else len(ticket), len(answers)))
+        parts.append(topic)
+        for ticket_question_id in ticket or ():
+            parts.append(bytes.fromhex(ticket_question_id))
+        for answer in answers:
+            parts.append(_ANSWER_LEN.pack(len(answer)))
+            parts.append(answer)
+    return b"".join(parts)
+
+
+def encode_stats(stats):
+    items = list(stats.items())
+    parts = [_HEADER.pack(STATS_MAGIC, len(items))]
+    for user_id, record in items:
+        username = (record.username or "").encode('utf-8')[:255]
+        parts.append(_STATS.pack(int(user_id), record.text_requests, record.voice_requests,
+                                 record.exam_answered, len(username)))
+        parts.append(username)
+    return b"".join(parts)
+
+
+def save_sessions(filename, sessions):
+    with _write_lock:
+        write_atomic(filename, encode_sessions(sessions))
+
+
+def save_stats(filename, stats):
+    with _write_lock:
+        write_atomic(filename, encode_stats(stats))
+
+
+# ======================== ЧТЕНИЕ ========================
+
+def _read_header(payload, magic):
+    if len(payload) < _HEADER.size:
+        raise ValueError("файл короче заголовка")
+    file_magic, count = _HEADER.unpack_from(payload, 0)
+    if file_magic != magic:
+        raise ValueError(f"неверная сигнатура {file_magic!r}")
+    return count, _HEADER.size
+
+
+def decode_sessions(payload):
+    if payload[:4] == SESSIONS_MAGIC_V1:
+        return _decode_sessions_v1(payload)
+    count, offset = _read_header(payload, SESSIONS_MAGIC)
+    sessions = {}
+    for _ in range(count):
+        (user_id, phase, topic_len, question_id, start_time,
+         ticket_len, answers_count) = _SESSION.unpack_from(payload, offset)
+        offset += _SESSION.size
+        topic = payload[offset:offset + topic_len].decode('utf-8')
+        offset += topic_len
+        ticket = None
+        if ticket_len != NO_TICKET:
+            ticket = [payload[offset + 6 * i:offset + 6 * (i + 1)].hex() for i in range(ticket_len)]
+            offset += 6 * ticket_len
+        answers = []
+        for _ in range(answers_count):
+            (answer_len,) = _ANSWER_LEN.unpack_from(payload, offset)
+            offset += _ANSWER_LEN.size
+            answers.append(payload[offset:offset + answer_len].decode('utf-8', 'ignore'))
+            offset += answer_len
+        sessions[str(user_id)] = ExamSession(
+            topic or None,
+            question_id.hex() if question_id != _NO_QUESTION else None,
+            phase,
+            start_time,
+            ticket,
+            answers,
+        )
+    if offset != len(payload):
+        raise ValueError("лишние байты в конце файла")
+    return sessions
+
+
+def _decode_sessions_v1(payload):
+    count, offset = _read_header(payload, SESSIONS_MAGIC_V1)
+    sessions = {}
+    for _ in range(count):
+        user_id, phase, topic_len, question_id, start_time = _SESSION_V1.unpack_from(payload, offset)
+        offset += _SESSION_V1.size
+        topic = payload[offset:offset + topic_len].decode('utf-8')
+        offset += topic_len
+        sessions[str(user_id)] = ExamSession(
+            topic or None,
+            question_id.hex() if question_id != _NO_QUESTION else None,
+            phase,
+            start_time,
+        )
+    if offset != len(payload):
+        raise ValueError("лишние байты в конце файла")
+    return sessions
+
+
+def _read_exact(file, size):
+    data = file.read(size)
+    if len(data) != size:
+        raise ValueError("файл обрывается посреди записи")
+    return data
+
+
+def _read_stats_records(file):
+    """(user_id, UserStats) по одной записи из открытого бинарного файла"""
+    count, _ = _read_header(file.read(_HEADER.size), STATS_MAGIC)
+    for _ in range(count):
+        user_id, text_requests, voice_requests, exam_answered, name_len = _STATS.unpack(
+            _read_exact(file, _STATS.size))
+        username = _read_exact(file, name_len).decode('utf-8', 'ignore')
+        yield str(user_id), UserStats(username or None, text_requests, voice_requests, exam_answered)
+
+
+def decode_stats(payload):
+    file = io.BytesIO(payload)
+    stats = dict(_read_stats_records(file))
+    if file.read(1):
+        raise ValueError("лишние байты в конце файла")
+    return stats
+
+
+def session_from_legacy(state):
+    """Конвертация dict-состояния из старого exam_states.json"""
+    if state.get("waiting_answer"):
+        phase = PHASE_ANSWER
+    elif state.get("waiting_action"):
+        phase = PHASE_ACTION
+    else:
+        phase = PHASE_TOPIC
+    question = state.get("question")
+    return ExamSession(
+        state.get("topic"),
+        get_question_hash(question) if question else None,
+        phase,
+        int(state.get("start_time", 0)),
+    )
+
+
+def stats_from_legacy(record):
+    """Конвертация dict-записи из старого user_stats.json (поле model отбрасывается)"""
+    return UserStats(
+        record.get("username"),
+        record.get("text_requests", 0),
+        record.get("voice_requests", 0),
+        record.get("exam_answered", 0),
+    )
+
+
+def _load(filename, legacy_filename, decode, from_legacy):
+    if os.path.exists(filename):
+        with open(filename, "rb") as file:
+            return decode(file.read())
+    if legacy_filename and os.path.exists(legacy_filename):
+        with open(legacy_filename, "r", encoding='utf-8') as file:
+            content = file.read().strip()
+        legacy = json.loads(content) if content else {}
+        return {user_id: from_legacy(value) for user_id, value in legacy.items()}
+    return {}
+
+
+def load_sessions(filename, legacy_filename=None):
+    """Загрузка состояний экзамена; при отсутствии бинарного файла читает старый JSON"""
+    return _load(filename, legacy_filename, decode_sessions, session_from_legacy)
+
+
+def load_stats(filename, legacy_filename=None):
+    """Загрузка статистики; при отсутствии бинарного файла читает старый JSON"""
+    return _load(filename, legacy_filename, decode_stats, stats_from_legacy)
+
+
+# ======================== ПОТОКОВОЕ ЧТЕНИЕ ========================
+
+class _JsonStream:
+    """Чтение JSON по одному значению: в памяти только буфер и текущее значение"""
+
+    def __init__(self, file, chunk_size):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Следующий непробельный символ; '' в конце файла"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self._fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"ожидался {char!r}, найдено {found!r}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            if end == len(self.buffer) and self._fill():
+                continue  # Число могло оборваться на границе блока
+            self.pos = end
+            return value
+
+
+def iter_json_items(filename, chunk_size=1 << 16):
+    """
+    Пары (ключ, значение) JSON-объекта верхнего уровня по одной —
+    например, пользователи user_question_stats.json. Пустой файл — пустой объект.
+    """
+    with open(filename, "r", encoding='utf-8') as file:
+        stream = _JsonStream(file, chunk_size)
+        if stream.peek() == "":
+            return
+        stream.expect("{")
+        if stream.peek() == "}":
+            return
+        while True:
+            key = stream.value()
+            stream.expect(":")
+            yield key, stream.value()
+            if stream.peek() != ",":
+                stream.expect("}")
+                return
+            stream.pos += 1
+
+
+def iter_stats(filename, legacy_filename=None):
+    """Статистика пользователей по одной записи; при отсутствии бинарного файла — из старого JSON"""
+    if os.path.exists(filename):
+        with open(filename, "rb") as file:
+            yield from _read_stats_records(file)
+    elif legacy_filename and os.path.exists(legacy_filename):
+        for user_id, record in iter_json_items(legacy_filename):
+            yield user_id, stats_from_legacy(record)
+
+
+# ======================== САМОПРОВЕРКА ========================
+
+def mastery_matches(mastery, expected):
+    """Совпадает ли инкрементальный агрегат с построенным с нуля"""
+    return (mastery is not None and mastery.seen == expected.seen
+            and abs(mastery.score_sum - expected.score_sum) < 1e-6
+            and mastery.weakest == expected.weakest)
+
+
+def check_topic_mastery(seed=1, rounds=300, max_history=5):
+    """
+    TopicMastery.update на случайных последовательностях оценок против from_scores.
+    Мало вопросов и крайние баллы — слабые вопросы часто поднимаются выше границы weakest.
+    Возвращает список расхождений.
+    """
+    rng = random.Random(seed)
+    problems = []
+    for round_index in range(rounds):
+        mastery, topic_scores = TopicMastery(), {}
+        questions = [f"q{i}" for i in range(rng.randint(1, 8))]
+        for _ in range(rng.randint(1, 60)):
+            question_id = rng.choice(questions)
+            scores = topic_scores.setdefault(question_id, [])
+            old_avg = sum(scores) / len(scores) if scores else None
+            scores.append(rng.choice([0, 10, 50, 90, 100]))
+            del scores[:-max_history]
+            mastery.update(question_id, old_avg, sum(scores) / len(scores), topic_scores)
+            if not mastery_matches(mastery, TopicMastery.from_scores(topic_scores)):
+                problems.append(f"последовательность {round_index}: weakest {mastery.weakest}")
+                break
+    return problems
+
+
+if __name__ == "__main__":
+    problems = check_topic_mastery()
+    for problem in problems:
+        print(f"❌ TopicMastery: {problem}")
+    if problems:
+        sys.exit(1)
+    print("✅ TopicMastery.update совпадает с from_scores")